@@ -0,0 +1,97 @@
+"""
+Form Builder Bug Report - Request Body Parsing
+Reads large multimodal request bodies without duplicating base64 screenshots
+"""
+
+import json
+import re
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Matches "image_url": {"url": "data:image/...;base64,..."}, the only place
+# images are read from; a url elsewhere, or after other keys, stays a string.
+# Requiring the { or , that opens a member rules out keys merely ending in
+# image_url, and escaped quotes inside JSON strings can never produce the sequence
+DATA_URI_PATTERN = re.compile(
+    rb'(?<=[{,])(\s*"image_url"\s*:\s*\{\s*"url"\s*:\s*)'
+    rb'"data:(image/[A-Za-z0-9.+-]+);base64,([A-Za-z0-9+/]*={0,2})"'
+)
+PLACEHOLDER_PREFIX = '\x00blob:'
+
+
+class DataURI:
+    """A base64 data URI kept as a view over the raw request body"""
+
+    __slots__ = ('mime_type', 'data')
+
+    def __init__(self, mime_type, data):
+        self.mime_type = mime_type
+        self.data = data
+
+    def __len__(self):
+        # Length of the equivalent "data:<mime>;base64,<data>" string
+        return len(self.mime_type) + 13 + len(self.data)
+
+    def __str__(self):
+        return f'data:{self.mime_type};base64,' + str(self.data, 'ascii')
+
+
+def read_body(rfile, content_length):
+    """Read exactly content_length bytes into a single preallocated buffer"""
+    buffer = bytearray(content_length)
+    view = memoryview(buffer)
+    received = 0
+    while received < content_length:
+        count = rfile.readinto(view[received:received + READ_CHUNK_SIZE])
+        if not count:
+            raise ValueError('Incomplete request body')
+        received += count
+    return buffer
+
+
+def parse_body(raw):
+    """Parse a JSON body, lifting base64 images out before decoding
+
+    Image payloads are replaced with short placeholders so json.loads only
+    handles the small remainder; the images come back as DataURI objects
+    that reference the original buffer instead of new Python strings.
+    """
+    view = memoryview(raw)
+    blobs = {}
+    pieces = []
+    position = 0
+
+    for match in DATA_URI_PATTERN.finditer(raw):
+        placeholder = f'{PLACEHOLDER_PREFIX}{len(blobs)}'
+        blobs[placeholder] = DataURI(
+            match.group(2).decode('ascii'),
+            view[match.start(3):match.end(3)]
+        )
+        pieces.append(view[position:match.end(1)])
+        pieces.append(json.dumps(placeholder).encode('ascii'))
+        position = match.end()
+
+    if not blobs:
+        return json.loads(raw)
+    pieces.append(view[position:])
+
+    def restore_blobs(obj):
+        url = obj.get('url')
+        if isinstance(url, str) and url in blobs:
+            obj['url'] = blobs[url]
+        return obj
+
+    return json.loads(b''.join(pieces), object_hook=restore_blobs)
+
+
+def materialize_data_uris(messages):
+    """Convert any DataURI objects in message content back to strings"""
+    for msg in messages:
+        content = msg.get('content') if isinstance(msg, dict) else None
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            image_url = part.get('image_url') if isinstance(part, dict) else None
+            if isinstance(image_url, dict) and isinstance(image_url.get('url'), DataURI):
+                image_url['url'] = str(image_url['url'])
+    return messages
@@ -0,0 +1,106 @@
+"""
+Form Builder Bug Report - Circuit Breaker
+Stops sending traffic to a model that keeps failing or stalling
+"""
+
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker fed with call outcomes and latencies
+
+    While closed, calls are tracked in a rolling window; once min_samples
+    calls are in it and either the error rate or the share of calls slower
+    than slow_call_seconds reaches its threshold, the breaker opens. After
+    open_seconds it lets a single probe through: success closes it again,
+    failure re-opens it. A probe that ends without a verdict is released so
+    the next call can probe; one that never reports back is replaced after
+    probe_timeout seconds.
+
+    Not thread-safe on its own; ModelRouter serializes access.
+    """
+
+    def __init__(self, window=20, min_samples=5, max_error_rate=0.5,
+                 slow_call_seconds=20.0, max_slow_rate=0.5, open_seconds=30.0,
+                 probe_timeout=60.0):
+        self.outcomes = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.max_slow_rate = max_slow_rate
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def current_state(self, now):
+        """State as seen by a caller arriving now"""
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return self.state
+
+    def remaining(self, now):
+        """Seconds until an open breaker will accept a probe"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (now - self.opened_at))
+
+    def allow(self, now):
+        """Whether a call may go out now; reserves the probe when half-open"""
+        if self.current_state(now) == CLOSED:
+            return True
+        if self.current_state(now) == OPEN:
+            return False
+
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+            self.probe_started_at = None
+        if self.probe_started_at is not None and now - self.probe_started_at < self.probe_timeout:
+            return False
+        self.probe_started_at = now
+        return True
+
+    def release(self):
+        """Free the half-open probe without counting an outcome"""
+        if self.state == HALF_OPEN:
+            self.probe_started_at = None
+
+    def record(self, ok, latency, now):
+        slow = latency > self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if ok and not slow:
+                self.state = CLOSED
+                self.outcomes.clear()
+                self.probe_started_at = None
+            else:
+                self.trip(now)
+            return
+        if self.state == OPEN:
+            # Stragglers sent before the breaker tripped
+            return
+
+        self.outcomes.append((ok, slow))
+        if len(self.outcomes) < self.min_samples:
+            return
+        errors = sum(1 for ok, _ in self.outcomes if not ok)
+        slow_calls = sum(1 for _, slow in self.outcomes if slow)
+        if (errors / len(self.outcomes) >= self.max_error_rate
+                or slow_calls / len(self.outcomes) >= self.max_slow_rate):
+            self.trip(now)
+
+    def trip(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_started_at = None
+        self.outcomes.clear()
+
+    def snapshot(self, now):
+        return {
+            'state': self.current_state(now),
+            'retry_after': round(self.remaining(now), 1)
+        }
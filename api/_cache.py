@@ -0,0 +1,172 @@
+"""
+Form Builder Bug Report - Cache Backends
+Key-value stores for cached completions and server-side conversation history
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def normalize_messages(messages):
+    """Reduce messages to a canonical form so equivalent prompts hash alike"""
+    normalized = []
+    for msg in messages:
+        if not isinstance(msg, dict):
+            normalized.append(msg)
+            continue
+        content = msg.get('content', [])
+        if not isinstance(content, list):
+            content = [{'type': 'text', 'text': str(content)}]
+
+        parts = []
+        for part in content:
+            if isinstance(part, dict) and part.get('type') == 'text':
+                parts.append({'type': 'text', 'text': str(part.get('text') or '').strip()})
+            else:
+                parts.append(part)
+
+        normalized.append({'role': msg.get('role', 'user'), 'content': parts})
+    return normalized
+
+
+def cache_key(models, system_prompt, max_tokens, temperature, messages):
+    """Build a SHA-256 key over everything that determines the completion
+
+    models is every model the request may be routed to, so changing the
+    fallback or text models does not serve replies cached under another
+    configuration.
+    """
+    canonical = json.dumps(
+        {
+            'models': models,
+            'system_prompt': system_prompt,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'messages': normalize_messages(messages)
+        },
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """On-disk LRU cache shared by every process on the same host"""
+
+    def __init__(self, path, max_entries, ttl, namespace='responses'):
+        if not namespace.isidentifier():
+            raise ValueError(f'Invalid cache namespace: {namespace}')
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.table = namespace
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'expires_at REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+
+    def connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        with self.connect() as conn:
+            row = conn.execute(
+                f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return None
+            conn.execute(f'UPDATE {self.table} SET last_used = ? WHERE key = ?', (now, key))
+            return bytes(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now)
+            )
+            conn.execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (now,))
+            conn.execute(
+                f'DELETE FROM {self.table} WHERE key IN ('
+                f'SELECT key FROM {self.table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+
+
+class RedisCache:
+    """Redis-backed cache; eviction follows the server's maxmemory-policy"""
+
+    def __init__(self, url, ttl, namespace='responses'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis cache backend requires the "redis" package')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = f'bug-report:{namespace}:'
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+
+def create_cache(backend, max_entries, ttl, sqlite_path=None, redis_url=None,
+                 namespace='responses'):
+    """Instantiate the configured cache backend, or None when disabled"""
+    if backend == 'memory':
+        return MemoryCache(max_entries, ttl)
+    if backend == 'sqlite':
+        return SQLiteCache(sqlite_path, max_entries, ttl, namespace)
+    if backend == 'redis':
+        return RedisCache(redis_url, ttl, namespace)
+    if backend in ('', 'none', 'off'):
+        return None
+    raise ValueError(f'Unknown cache backend: {backend}')
@@ -0,0 +1,158 @@
+"""
+Form Builder Bug Report - Image Ingestion
+Downscales and re-encodes base64 screenshots before they are sent upstream
+"""
+
+import base64
+import binascii
+import io
+
+# Pillow is imported by load_pillow() when the first screenshot arrives, so
+# text-only cold starts skip it; False means it is not installed
+Image = ImageOps = None
+
+
+def load_pillow():
+    """Import Pillow on first use; returns whether it is available"""
+    global Image, ImageOps
+    if Image is None:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            Image = False
+    return Image is not False
+
+
+def decode_data_uri(url):
+    """Split a base64 data URI into its MIME type and raw bytes"""
+    if not isinstance(url, str):
+        # DataURI from the request body parser, still backed by the raw buffer
+        try:
+            return url.mime_type, base64.b64decode(url.data, validate=True)
+        except (binascii.Error, ValueError):
+            return None, None
+
+    header, _, data = url.partition(',')
+    if not header.startswith('data:') or not header.endswith(';base64'):
+        return None, None
+    try:
+        return header[5:-7], base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        return None, None
+
+
+def encode_image(image, image_format, quality):
+    """Encode an image without EXIF, ICC or other metadata"""
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel, so flatten transparency onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+class TooManyPixels(ValueError):
+    """Raised for images whose header declares more pixels than allowed"""
+
+
+def shrink_image(raw, max_dimension, image_format, quality, max_pixels):
+    """Downscale and re-encode image bytes, returning (mime_type, bytes)"""
+    image = Image.open(io.BytesIO(raw))
+
+    # Only the header has been read so far; a small file can still declare
+    # a huge canvas that would take seconds and hundreds of MB to decode
+    width, height = image.size
+    if width * height > max_pixels:
+        raise TooManyPixels(f'{width}x{height} exceeds {max_pixels} pixels')
+
+    # Let the JPEG decoder skip detail we are about to throw away
+    image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    try:
+        encoded = encode_image(image, image_format, quality)
+    except (KeyError, OSError):
+        # Pillow was built without an encoder for the requested format
+        image_format = 'JPEG'
+        encoded = encode_image(image, image_format, quality)
+    return f'image/{image_format.lower()}', encoded
+
+
+def data_uri(part):
+    """The data URI of an image_url content part, or None for any other part
+
+    Remote URLs and malformed parts (not an object, or image_url given as
+    a plain string) are None too; they are forwarded as sent.
+    """
+    if not isinstance(part, dict) or part.get('type') != 'image_url':
+        return None
+    image_url = part.get('image_url')
+    url = image_url.get('url') if isinstance(image_url, dict) else None
+    if isinstance(url, str):
+        return url if url.startswith('data:') else None
+    # DataURI from the request body parser
+    return url if hasattr(url, 'mime_type') else None
+
+
+def has_images(messages):
+    """Check whether any message carries an image part"""
+    for msg in messages:
+        content = msg.get('content') if isinstance(msg, dict) else None
+        if isinstance(content, list) and any(
+            isinstance(part, dict) and part.get('type') == 'image_url' for part in content
+        ):
+            return True
+    return False
+
+
+def process_images(messages, max_dimension, image_format, quality, max_pixels):
+    """Shrink every data-URI image in the messages
+
+    Returns a new message list and a stats dict with the image count and
+    byte totals before and after processing. Images that cannot be decoded,
+    have more than max_pixels pixels or would not get smaller are forwarded
+    unchanged.
+    """
+    stats = {'images': 0, 'bytes_before': 0, 'bytes_after': 0}
+    processed = []
+
+    for msg in messages:
+        content = msg.get('content') if isinstance(msg, dict) else None
+        if not isinstance(content, list):
+            processed.append(msg)
+            continue
+
+        parts = []
+        for part in content:
+            url = data_uri(part)
+            if url is None:
+                parts.append(part)
+                continue
+
+            stats['images'] += 1
+            stats['bytes_before'] += len(url)
+
+            mime_type, raw = decode_data_uri(url)
+            if raw is not None and load_pillow():
+                try:
+                    mime_type, encoded = shrink_image(raw, max_dimension, image_format, quality, max_pixels)
+                    new_url = f'data:{mime_type};base64,' + base64.b64encode(encoded).decode('ascii')
+                    if len(new_url) < len(url):
+                        url = new_url
+                except Exception:
+                    pass
+
+            url = str(url)
+            stats['bytes_after'] += len(url)
+            parts.append({**part, 'image_url': {**part['image_url'], 'url': url}})
+
+        processed.append({**msg, 'content': parts})
+
+    return processed, stats
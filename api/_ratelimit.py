@@ -0,0 +1,110 @@
+"""
+Form Builder Bug Report - Admission Control
+Token-bucket rate limiting per client and globally, with a bounded wait queue
+"""
+
+from collections import OrderedDict
+import math
+import threading
+import time
+
+
+class RateLimited(Exception):
+    """Raised when a request cannot be admitted within the queue limits"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited; retry after {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of refusing
+
+    Tokens may go negative; a negative balance is the queue of reservations
+    waiting for the bucket to refill.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay_for_next(self, now):
+        """Seconds until a token reserved now becomes available"""
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """Global and per-client token buckets sharing one bounded wait queue
+
+    A rate of 0 disables that bucket. Requests that would wait longer than
+    max_wait seconds, or arrive while max_queue requests are already
+    waiting, are rejected with a Retry-After hint.
+    """
+
+    def __init__(self, global_rate, global_burst, client_rate, client_burst,
+                 max_queue, max_wait, max_clients=10000):
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.client_buckets = OrderedDict()
+        self.max_clients = max_clients
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def client_bucket(self, client_id):
+        bucket = self.client_buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self.client_buckets[client_id] = bucket
+            # Forget the least recently seen clients; their buckets would be full anyway
+            while len(self.client_buckets) > self.max_clients:
+                self.client_buckets.popitem(last=False)
+        self.client_buckets.move_to_end(client_id)
+        return bucket
+
+    def admit(self, client_id, max_wait=None):
+        """Reserve capacity for one upstream call
+
+        Returns the seconds the caller must wait before proceeding; callers
+        given a non-zero delay must call release() once they stop waiting.
+        Raises RateLimited when the request should be rejected. max_wait
+        lowers the limiter's own limit for callers with less time to spare.
+        """
+        if max_wait is None or max_wait > self.max_wait:
+            max_wait = self.max_wait
+        now = time.monotonic()
+        with self.lock:
+            buckets = []
+            if self.global_bucket is not None:
+                buckets.append(self.global_bucket)
+            if self.client_rate > 0:
+                buckets.append(self.client_bucket(client_id))
+
+            delay = max([bucket.delay_for_next(now) for bucket in buckets] or [0.0])
+            if delay > 0 and (delay > max_wait or self.waiting >= self.max_queue):
+                raise RateLimited(max(1, math.ceil(delay)))
+
+            for bucket in buckets:
+                bucket.take()
+            if delay > 0:
+                self.waiting += 1
+            return delay
+
+    def release(self):
+        """Mark a queued request as no longer waiting"""
+        with self.lock:
+            self.waiting -= 1
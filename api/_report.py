@@ -0,0 +1,236 @@
+"""
+Form Builder Bug Report - Report Structure
+Parses generated bug reports into their sections, checks the format rules
+and supports targeted repair and early stream termination
+"""
+
+import re
+
+SECTIONS = ('Summary', 'Title', 'Reproduce Steps', 'Actual Result', 'Expected Result')
+SEPARATOR = '_' * 55
+
+# Section labels, tolerating Markdown emphasis or heading marks around them
+LABEL_PATTERN = re.compile(
+    r'^[#*\s]*(' + '|'.join(re.escape(name) for name in SECTIONS) + r')\s*:?[*\s]*:?\s*$'
+)
+SEPARATOR_PATTERN = re.compile(r'^\s*_{10,}\s*$')
+NUMBERED_PATTERN = re.compile(r'^\s*\d+[.)]\s+\S')
+BULLET_PATTERN = re.compile(r'^\s*[*\-•]\s+\S')
+SENTENCE_END_PATTERN = re.compile(r'[.!?](?:\s|$)')
+
+# Per-section rules, as given to the model when a section needs repair
+SECTION_RULES = {
+    'Summary': '1-2 sentences describing the issue and its impact',
+    'Title': 'one line in the format: Area | Module | Component | Issue description',
+    'Reproduce Steps': 'a numbered list of deterministic steps',
+    'Actual Result': 'bullet points describing the incorrect behavior',
+    'Expected Result': 'bullet points describing the correct behavior, contrasting with Actual Result'
+}
+
+REPAIR_PROMPT = """You fix individual sections of a QA bug report for a low-code Form Builder platform.
+Rewrite ONLY the sections you are asked for, using the facts already in the report. Do not invent details.
+Output each rewritten section as its label on its own line (for example "Title:") followed by its content.
+Output nothing else."""
+
+
+def parse_report(text):
+    """Split a report into (label, body lines) pairs in the order they appear
+
+    Text before the first label is returned under the label None, and
+    separator lines are dropped.
+    """
+    sections = [(None, [])]
+    for line in text.splitlines():
+        match = LABEL_PATTERN.match(line)
+        if match:
+            sections.append((match.group(1), []))
+        elif not SEPARATOR_PATTERN.match(line):
+            sections[-1][1].append(line)
+    return [(label, [line for line in lines if line.strip()]) for label, lines in sections]
+
+
+def count_separators(text):
+    return sum(1 for line in text.splitlines() if SEPARATOR_PATTERN.match(line))
+
+
+def check_section(name, lines):
+    """Problems with one section body; an empty list means it is valid"""
+    if not lines:
+        return ['is empty']
+
+    if name == 'Summary':
+        sentences = len(SENTENCE_END_PATTERN.findall(' '.join(lines)))
+        if sentences > 2:
+            return [f'has {sentences} sentences (maximum 2)']
+    elif name == 'Title':
+        if len(lines) != 1 or len(lines[0].split('|')) != 4:
+            return ['must be one line: Area | Module | Component | Issue description']
+    elif name == 'Reproduce Steps':
+        if not all(NUMBERED_PATTERN.match(line) for line in lines):
+            return ['must be a numbered list']
+    elif name in ('Actual Result', 'Expected Result'):
+        if not all(BULLET_PATTERN.match(line) for line in lines):
+            return ['must be bullet points']
+    return []
+
+
+def validate_report(text):
+    """Check a report against the required structure
+
+    Returns a list of (section, problem) pairs; section is None for
+    problems with the report as a whole. An empty list means the report
+    is compliant.
+    """
+    problems = []
+    sections = parse_report(text)
+
+    preamble, sections = sections[0][1], sections[1:]
+    if preamble:
+        problems.append((None, 'has text before Summary'))
+
+    labels = [label for label, _ in sections]
+    if labels != list(SECTIONS):
+        missing = [name for name in SECTIONS if name not in labels]
+        if missing:
+            problems.append((None, 'is missing ' + ', '.join(missing)))
+        elif len(labels) != len(set(labels)):
+            problems.append((None, 'repeats a section'))
+        else:
+            problems.append((None, 'has sections out of order'))
+
+    if count_separators(text) < len(SECTIONS) - 1:
+        problems.append((None, 'is missing separator lines between sections'))
+
+    seen = set()
+    for label, lines in sections:
+        if label in seen:
+            continue
+        seen.add(label)
+        problems.extend((label, problem) for problem in check_section(label, lines))
+    return problems
+
+
+def report_sections(text):
+    """First occurrence of each labelled section, as {label: body lines}"""
+    sections = {}
+    for label, lines in parse_report(text)[1:]:
+        sections.setdefault(label, lines)
+    return sections
+
+
+def format_report(sections):
+    """Render sections in the required order with separator lines"""
+    blocks = [f'{name}:\n' + '\n'.join(sections.get(name, [])) for name in SECTIONS]
+    return f'\n{SEPARATOR}\n\n'.join(blocks)
+
+
+def repair_targets(sections):
+    """Sections that are missing or break their rules"""
+    return [name for name in SECTIONS if name not in sections or check_section(name, sections[name])]
+
+
+def build_repair_messages(sections, targets):
+    """Messages asking the model to rewrite only the target sections"""
+    rules = '\n'.join(f'- {name}: {SECTION_RULES[name]}' for name in targets)
+    return [
+        {'role': 'system', 'content': REPAIR_PROMPT},
+        {'role': 'user', 'content': f'Report:\n\n{format_report(sections)}\n\nRewrite these sections:\n{rules}'}
+    ]
+
+
+def merge_repair(sections, targets, reply):
+    """Splice repaired sections from the model's reply into the report
+
+    Only replacement sections that pass their own checks are used. Returns
+    the merged sections and the names that were actually repaired.
+    """
+    merged = dict(sections)
+    repaired = []
+    replies = report_sections(reply)
+    for name in targets:
+        lines = replies.get(name)
+        if lines and not check_section(name, lines):
+            merged[name] = lines
+            repaired.append(name)
+    return merged, repaired
+
+
+class ReportStreamGuard:
+    """Stops a streamed report once its Expected Result bullets are complete
+
+    Text passes through unchanged until Expected Result has at least one
+    bullet. From then on each new line is held back until its first
+    characters show what it is: bullets, blank lines and continuations
+    (indented, or starting in lowercase after a line that stopped
+    mid-sentence) are released, and anything else (commentary, a
+    separator, a repeated report) ends the report, with that line and the
+    rest of the stream withheld.
+    """
+
+    def __init__(self):
+        self.section = None
+        self.bullets = 0
+        self.line = ''
+        self.line_ok = None
+        self.previous = ''
+        self.done = False
+
+    def watching(self):
+        return self.section == 'Expected Result' and self.bullets > 0
+
+    @staticmethod
+    def classify(line, complete, previous=''):
+        """True to release the line, False to end the report, None to wait for more
+
+        previous is the line before, used to recognise a bullet wrapped
+        onto an unindented line.
+        """
+        stripped = line.strip()
+        if not stripped:
+            return True if complete else None
+        if line[0] in ' \t':
+            return True
+        if stripped[0] in '*-•':
+            if len(stripped) > 1 or complete:
+                return bool(BULLET_PATTERN.match(line))
+            return None
+        previous = previous.rstrip()
+        return bool(previous) and previous[-1] not in '.!?:' and stripped[0].islower()
+
+    def observe(self, line):
+        match = LABEL_PATTERN.match(line)
+        if match:
+            self.section = match.group(1)
+            self.bullets = 0
+        elif self.section == 'Expected Result' and BULLET_PATTERN.match(line):
+            self.bullets += 1
+
+    def feed(self, text):
+        """Return the part of text that may be sent to the client"""
+        if self.done:
+            return ''
+        released = []
+        for piece in text.splitlines(keepends=True):
+            complete = piece.endswith(('\n', '\r'))
+            self.line += piece
+
+            if not self.watching():
+                released.append(piece)
+            elif self.line_ok is None:
+                self.line_ok = self.classify(self.line, complete, self.previous)
+                if self.line_ok:
+                    # Nothing of this line has been sent yet
+                    released.append(self.line)
+                elif self.line_ok is False:
+                    self.done = True
+                    break
+            elif self.line_ok:
+                released.append(piece)
+
+            if complete:
+                if not self.watching():
+                    self.observe(self.line)
+                self.previous = self.line
+                self.line = ''
+                self.line_ok = None
+        return ''.join(released)
@@ -0,0 +1,159 @@
+"""
+Form Builder Bug Report - Model Routing
+Tracks per-model latency and error rate to pick the fastest healthy model
+"""
+
+from collections import deque
+import threading
+import time
+
+from api._breaker import OPEN, CircuitBreaker
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ModelStats:
+    """Rolling window of latencies and outcomes for one model"""
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, latency, ok):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            'samples': len(self.outcomes),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'error_rate': round(self.error_rate(), 3)
+        }
+
+
+class ModelRouter:
+    """Orders candidate models by health, then by median latency
+
+    Models without samples are tried first so every model in the pool gets
+    measured; after that the fastest healthy model leads and the rest are
+    kept as fallbacks in latency order. When breaker options are given, each
+    model also gets a CircuitBreaker and models whose breaker is open are
+    left out of the candidates entirely.
+    """
+
+    def __init__(self, vision_models, text_models=(), window=50,
+                 max_error_rate=0.5, min_samples=5, breaker=None):
+        self.vision_models = list(vision_models)
+        self.text_models = list(text_models)
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+        self.stats = {
+            model: ModelStats(window)
+            for model in self.vision_models + self.text_models
+        }
+        self.breakers = {
+            model: CircuitBreaker(**breaker)
+            for model in self.stats
+        } if breaker else {}
+
+    def is_healthy(self, model):
+        stats = self.stats[model]
+        if len(stats.outcomes) < self.min_samples:
+            return True
+        return stats.error_rate() <= self.max_error_rate
+
+    def rank(self, models):
+        """Sort models: healthy before unhealthy, unmeasured first, then by p50"""
+        def sort_key(item):
+            index, model = item
+            stats = self.stats[model]
+            p50 = percentile(sorted(stats.latencies), 0.50)
+            return (
+                not self.is_healthy(model),
+                len(stats.outcomes) > 0,
+                p50 if p50 is not None else float('inf'),
+                index
+            )
+
+        with self.lock:
+            now = time.monotonic()
+            available = [
+                (index, model) for index, model in enumerate(models)
+                if model not in self.breakers or self.breakers[model].current_state(now) != OPEN
+            ]
+            return [model for _, model in sorted(available, key=sort_key)]
+
+    def candidates(self, has_images):
+        """Models to try in order; text-only requests prefer text models"""
+        if has_images or not self.text_models:
+            return self.rank(self.vision_models)
+        text_first = self.rank(self.text_models)
+        return text_first + [m for m in self.rank(self.vision_models) if m not in text_first]
+
+    def pool(self, has_images):
+        """Every model that may serve the request, in configured order"""
+        if has_images or not self.text_models:
+            return list(self.vision_models)
+        return self.text_models + [m for m in self.vision_models if m not in self.text_models]
+
+    def allow(self, model):
+        """Whether the model's breaker lets a call through right now"""
+        if model not in self.breakers:
+            return True
+        with self.lock:
+            return self.breakers[model].allow(time.monotonic())
+
+    def release(self, model):
+        """Hand back a half-open probe that ended without an outcome"""
+        if model not in self.breakers:
+            return
+        with self.lock:
+            self.breakers[model].release()
+
+    def reopen_delay(self, has_images):
+        """Seconds until the first open breaker in the request's pool probes again"""
+        models = self.vision_models if has_images else self.vision_models + self.text_models
+        with self.lock:
+            now = time.monotonic()
+            delays = [self.breakers[m].remaining(now) for m in models if m in self.breakers]
+        return min(delays, default=0.0)
+
+    def latency_percentile(self, model, fraction):
+        """Latency percentile for a model, or None before min_samples successes"""
+        with self.lock:
+            latencies = sorted(self.stats[model].latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return percentile(latencies, fraction)
+
+    def record(self, model, latency, ok):
+        with self.lock:
+            self.stats[model].record(latency, ok)
+            if model in self.breakers:
+                self.breakers[model].record(ok, latency, time.monotonic())
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            snapshot = {
+                model: dict(stats.snapshot(), healthy=self.is_healthy(model))
+                for model, stats in self.stats.items()
+            }
+            for model, breaker in self.breakers.items():
+                snapshot[model]['circuit'] = breaker.snapshot(now)
+            return snapshot
@@ -0,0 +1,41 @@
+"""
+Form Builder Bug Report - Request Coalescing
+Lets concurrent identical requests share a single upstream call
+"""
+
+from concurrent.futures import Future
+import threading
+
+
+class SingleFlight:
+    """Registry of in-flight calls keyed by request hash
+
+    The first caller for a key becomes the leader and must call finish();
+    later callers receive the leader's Future and wait on it. Futures work
+    for both threads (result(timeout)) and asyncio (asyncio.wrap_future).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def join(self, key):
+        """Return (future, is_leader) for a key"""
+        with self.lock:
+            future = self.flights.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.flights[key] = future
+            return future, True
+
+    def finish(self, key, result):
+        """Publish the leader's result (None on failure) and release the key"""
+        with self.lock:
+            future = self.flights.pop(key, None)
+        if future is not None:
+            future.set_result(result)
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.flights)
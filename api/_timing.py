@@ -0,0 +1,74 @@
+"""
+Form Builder Bug Report - Request Timing
+Per-request phase durations for the Server-Timing header and structured logs
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import json
+import sys
+import threading
+import time
+
+log_lock = threading.Lock()
+
+
+class RequestTiming:
+    """Phase durations and facts about one request
+
+    Phases are timed with phase() or add() and reported in the order they
+    first ran; mark() records when a moment such as the first streamed
+    token was first reached; note() attaches fields such as payload size
+    or token counts to the log line.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.marks = {}
+        self.fields = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def mark(self, name):
+        if name not in self.marks:
+            self.marks[name] = self.elapsed()
+
+    def note(self, **fields):
+        self.fields.update(fields)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def header(self):
+        """Server-Timing value for the phases finished so far"""
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.phases.items()]
+        parts.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(parts)
+
+    def log_record(self):
+        return {
+            'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            **self.fields,
+            **{f'{name}_ms': round(seconds * 1000, 1) for name, seconds in self.marks.items()},
+            'duration_ms': round(self.elapsed() * 1000, 1),
+            'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()}
+        }
+
+
+def write_log(record, stream=None):
+    """Write one record as a single JSON line"""
+    line = json.dumps(record, default=str) + '\n'
+    stream = stream or sys.stderr
+    with log_lock:
+        stream.write(line)
+        stream.flush()
@@ -0,0 +1,266 @@
+"""
+Form Builder Bug Report - Request Tracing
+Minimal OpenTelemetry-compatible spans with W3C traceparent propagation,
+exported as OTLP/JSON to a file or an OTLP/HTTP collector
+"""
+
+from contextlib import contextmanager
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# Span the code running now belongs to; None when the request is not traced
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def parse_traceparent(value):
+    """Return (trace_id, parent_span_id, sampled) from a traceparent header, or None"""
+    match = TRACEPARENT_PATTERN.match((value or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def random_id(bits):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_attributes(attributes):
+    return [{'key': key, 'value': otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """One timed operation within a trace
+
+    Finished spans are appended to the trace's shared list, which the root
+    span exports when the request ends.
+    """
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'message', 'finished')
+
+    def __init__(self, trace_id, name, kind, parent_id, attributes, finished):
+        self.trace_id = trace_id
+        self.span_id = random_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.message = None
+        self.finished = finished
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, message):
+        self.status = STATUS_ERROR
+        self.message = message
+
+    def finish(self):
+        self.end_ns = time.time_ns()
+        self.finished.append(self)
+
+    def traceparent(self):
+        """traceparent header value naming this span as the parent"""
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': otlp_attributes(self.attributes),
+            'status': {'code': self.status}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.message:
+            span['status']['message'] = self.message
+        return span
+
+
+@contextmanager
+def span(name, kind=SPAN_KIND_INTERNAL, **attributes):
+    """Child of the current span, or a no-op when the request is not traced
+
+    Yields the span (or None) so callers can add attributes or propagate it.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace_id, name, kind, parent.span_id, attributes, parent.finished)
+    token = current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.fail(getattr(e, 'message', None) or str(e))
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish()
+
+
+class FileExporter:
+    """Appends one OTLP/JSON document per trace to a file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, document):
+        line = json.dumps(document, separators=(',', ':')) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+class OTLPExporter:
+    """Posts traces to an OTLP/HTTP JSON endpoint from a background thread
+
+    Requests only enqueue; when the queue is full (collector down or slow),
+    traces are dropped rather than slowing requests down. The thread starts
+    with the first export in each process, since a forked worker does not
+    inherit its parent's.
+    """
+
+    def __init__(self, endpoint, max_queue=1024, batch_size=64, interval=2.0, timeout=5.0):
+        self.endpoint = endpoint
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.dropped = 0
+        self.queue = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def export(self, document):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(document)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        """Start this process's sending thread with a fresh queue"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.max_queue)
+            threading.Thread(target=self.run, args=(self.queue,), name='otlp-exporter', daemon=True).start()
+            self.pid = os.getpid()
+
+    def run(self, documents_queue):
+        while True:
+            documents = [documents_queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(documents) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    documents.append(documents_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.send(documents)
+
+    def send(self, documents):
+        body = json.dumps({
+            'resourceSpans': [rs for document in documents for rs in document['resourceSpans']]
+        }).encode('utf-8')
+        request = urllib.request.Request(self.endpoint, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except Exception:
+            self.dropped += len(documents)
+
+
+class Tracer:
+    """Starts sampled request traces and exports them when they end
+
+    A trace is recorded when the caller's traceparent (if any) is sampled
+    and the trace id falls under sample_rate, so every service applying
+    the same rate to the same trace makes the same decision.
+    """
+
+    def __init__(self, exporter, sample_rate=0.05, service_name='form-builder-bug-report'):
+        self.exporter = exporter
+        self.threshold = int(max(0.0, min(1.0, sample_rate)) * (1 << 64))
+        self.resource = {'attributes': otlp_attributes({'service.name': service_name})}
+        self.scope = {'name': service_name}
+
+    def sampled(self, trace_id):
+        return int(trace_id[16:], 16) < self.threshold
+
+    @contextmanager
+    def request(self, name, traceparent=None, **attributes):
+        """Root span for one incoming request, or None when it is not sampled"""
+        parent = parse_traceparent(traceparent)
+        trace_id, parent_id, parent_sampled = parent or (random_id(128), None, True)
+        if not parent_sampled or not self.sampled(trace_id):
+            yield None
+            return
+
+        root = Span(trace_id, name, SPAN_KIND_SERVER, parent_id, attributes, [])
+        token = current_span.set(root)
+        try:
+            yield root
+        except Exception as e:
+            root.fail(str(e))
+            raise
+        finally:
+            current_span.reset(token)
+            root.finish()
+            self.export(root.finished)
+
+    def export(self, spans):
+        try:
+            self.exporter.export({'resourceSpans': [{
+                'resource': self.resource,
+                'scopeSpans': [{'scope': self.scope, 'spans': [s.to_otlp() for s in spans]}]
+            }]})
+        except Exception:
+            pass
+
+
+def create_tracer(mode, sample_rate, file_path=None, endpoint=None, service_name='form-builder-bug-report'):
+    """Instantiate the configured tracer, or None when tracing is off"""
+    if mode in ('', 'off', 'none'):
+        return None
+    if mode == 'file':
+        return Tracer(FileExporter(file_path), sample_rate, service_name)
+    if mode == 'otlp':
+        return Tracer(OTLPExporter(endpoint), sample_rate, service_name)
+    raise ValueError(f'Unknown tracing mode: {mode}')
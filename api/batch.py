@@ -0,0 +1,315 @@
+"""
+Form Builder Bug Report - Batch API
+Vercel serverless function that turns many bug descriptions into reports in
+one request, streaming results back as NDJSON
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import math
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+from api import chat
+from api._body import parse_body, read_body
+from api._cache import create_cache
+from api._ratelimit import RateLimited, RateLimiter
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# Items per batch and how many of them are in flight at once
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+
+# Completed items are kept so an interrupted batch can be resumed
+BATCH_BACKEND = os.environ.get('BATCH_BACKEND', 'memory')
+BATCH_TTL = int(os.environ.get('BATCH_TTL', 86400))
+BATCH_MAX_ENTRIES = int(os.environ.get('BATCH_MAX_ENTRIES', 10000))
+
+# Batches get their own upstream budget so they neither starve nor are
+# throttled by the interactive limits
+BATCH_RATE_LIMIT_GLOBAL_RPM = float(os.environ.get('BATCH_RATE_LIMIT_GLOBAL_RPM', 60))
+BATCH_RATE_LIMIT_CLIENT_RPM = float(os.environ.get('BATCH_RATE_LIMIT_CLIENT_RPM', 30))
+# Seconds a batch request keeps admitting items; the rest are deferred to a resume
+BATCH_MAX_DURATION = float(os.environ.get('BATCH_MAX_DURATION', 240))
+
+# Each item in flight may race a hedge
+chat.configure_hedging(max(1, BATCH_CONCURRENCY))
+
+batch_limiter = RateLimiter(
+    BATCH_RATE_LIMIT_GLOBAL_RPM / 60,
+    max(1, BATCH_CONCURRENCY),
+    BATCH_RATE_LIMIT_CLIENT_RPM / 60,
+    max(1, BATCH_CONCURRENCY),
+    # Waiting items are already bounded by each batch's worker threads
+    math.inf,
+    BATCH_MAX_DURATION
+)
+
+batch_store = create_cache(
+    BATCH_BACKEND,
+    BATCH_MAX_ENTRIES,
+    BATCH_TTL,
+    sqlite_path=chat.CACHE_SQLITE_PATH,
+    redis_url=chat.CACHE_REDIS_URL,
+    namespace='batches'
+)
+
+
+def parse_items(raw, content_type):
+    """Parse a batch upload into (batch_id, prompt_variant, items)
+
+    Accepts a JSON array of items, an object with "items" (plus optional
+    "batch_id" and "prompt_variant"), or NDJSON with one item per line.
+    """
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        data = parse_ndjson(raw)
+    else:
+        try:
+            data = parse_body(raw)
+        except json.JSONDecodeError:
+            # Several top-level values: treat the body as NDJSON
+            data = parse_ndjson(raw)
+
+    batch_id = variant = None
+    if isinstance(data, dict):
+        batch_id = data.get('batch_id')
+        variant = data.get('prompt_variant')
+        data = data.get('items')
+    if not isinstance(data, list) or not data:
+        raise chat.ChatRequestError(400, 'No items provided in batch')
+    if len(data) > BATCH_MAX_ITEMS:
+        raise chat.ChatRequestError(413, f'Batch exceeds {BATCH_MAX_ITEMS} items')
+    return batch_id, variant, data
+
+
+def parse_ndjson(raw):
+    try:
+        return [parse_body(line) for line in raw.splitlines() if line.strip()]
+    except json.JSONDecodeError:
+        raise chat.ChatRequestError(400, 'Invalid JSON in request body')
+
+
+def item_id(item, index):
+    """The client's id for an item, or its position in the batch"""
+    if isinstance(item, dict) and item.get('id') is not None:
+        return str(item['id'])
+    return str(index)
+
+
+def item_messages(item):
+    """Messages for one item: a description string, or an object with text, message or messages"""
+    if isinstance(item, str):
+        return [{'role': 'user', 'content': item}]
+    if isinstance(item, dict):
+        if item.get('messages'):
+            return item['messages']
+        if item.get('message'):
+            return [item['message']]
+        if item.get('text'):
+            return [{'role': 'user', 'content': str(item['text'])}]
+    raise chat.ChatRequestError(400, 'Item has no text, message or messages')
+
+
+def load_result(batch_id, key):
+    """Return a stored result for a completed item, or None"""
+    if batch_store is None:
+        return None
+    try:
+        stored = batch_store.get(f'{batch_id}:{key}')
+        return json.loads(stored) if stored is not None else None
+    except Exception:
+        return None
+
+
+def save_result(batch_id, key, result):
+    if batch_store is None:
+        return
+    try:
+        batch_store.set(f'{batch_id}:{key}', json.dumps(result).encode('utf-8'))
+    except Exception:
+        pass
+
+
+def wait_for_admission(client, deadline):
+    """Block until the batch limiter admits one upstream call
+
+    Batch items wait their turn instead of failing, since the client is
+    already waiting for the whole batch, but only until deadline. Returns
+    False when the item cannot be admitted in time.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    try:
+        delay = batch_limiter.admit(client, max_wait=remaining)
+    except RateLimited:
+        return False
+    if delay:
+        try:
+            time.sleep(delay)
+        finally:
+            batch_limiter.release()
+    return True
+
+
+def process_item(api_key, batch_id, index, item, default_variant, client, deadline):
+    """Generate the report for one item and return its result line
+
+    Failures are reported in the result rather than raised, so one bad
+    item does not stop the batch. Successful results are stored for resume;
+    items not admitted before deadline are "deferred" and left for it.
+    """
+    key = item_id(item, index)
+    result = {'id': key, 'index': index}
+    extra_headers = {}
+    try:
+        messages = chat.prepare_images(item_messages(item), extra_headers)
+        requested = item.get('prompt_variant') if isinstance(item, dict) else None
+        variant = chat.choose_prompt_variant(requested or default_variant, f'{batch_id}:{key}')
+        system_prompt = chat.PROMPT_VARIANTS[variant]
+
+        cache = chat.response_cache_key(system_prompt, messages)
+        completion_body = chat.cache_lookup(cache)
+        if completion_body is None:
+            if not wait_for_admission(client, deadline):
+                result['status'] = 'deferred'
+                return result
+            completion_body = chat.run_plan(
+                chat.complete_report(api_key, messages, extra_headers, system_prompt, client, batch_limiter)
+            )
+            chat.cache_store(cache, completion_body)
+
+        result.update(chat.slim_completion(completion_body))
+        result['status'] = 'ok'
+        result['model'] = extra_headers.get('X-Model')
+        result['prompt_variant'] = variant
+    except chat.ChatRequestError as e:
+        result.update(status='error', status_code=e.status_code, error=e.message)
+        return result
+    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+        result.update(status='error', status_code=502, error='Invalid response from AI service')
+        return result
+    except Exception as e:
+        result.update(status='error', status_code=500, error=f'Internal server error: {str(e)}')
+        return result
+
+    save_result(batch_id, key, result)
+    return result
+
+
+def run_batch(api_key, batch_id, items, default_variant, client):
+    """Yield result lines as items finish, replaying completed ones first
+
+    Items already completed under this batch_id are returned from the store
+    with "resumed": true instead of calling the model again. Items are
+    admitted for BATCH_MAX_DURATION seconds. Closing the generator cancels
+    the items that have not started.
+    """
+    deadline = time.monotonic() + BATCH_MAX_DURATION
+    pending = []
+    for index, item in enumerate(items):
+        stored = load_result(batch_id, item_id(item, index))
+        if stored is not None:
+            stored['index'] = index
+            stored['resumed'] = True
+            yield stored
+        else:
+            pending.append((index, item))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, BATCH_CONCURRENCY), thread_name_prefix='batch')
+    try:
+        futures = [
+            executor.submit(process_item, api_key, batch_id, index, item, default_variant, client, deadline)
+            for index, item in pending
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Items already running finish and are stored for a later resume
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_summary(batch_id, results):
+    """Final line; "resume" is set when deferred items need another request"""
+    deferred = sum(1 for r in results if r['status'] == 'deferred')
+    return {
+        'batch_id': batch_id,
+        'total': len(results),
+        'ok': sum(1 for r in results if r['status'] == 'ok'),
+        'failed': sum(1 for r in results if r['status'] == 'error'),
+        'deferred': deferred,
+        'resumed': sum(1 for r in results if r.get('resumed')),
+        'resume': f'/api/batch?batch_id={batch_id}' if deferred else None
+    }
+
+
+class handler(chat.handler):
+    """HTTP request handler for the batch API endpoint"""
+
+    def do_GET(self):
+        self.send_error_response(405, 'Use POST to submit a batch')
+
+    def do_POST(self):
+        """Handle POST requests to the batch endpoint"""
+        self.extra_headers = {}
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length > chat.MAX_BODY_BYTES:
+                self.send_error_response(413, f'Request body exceeds {chat.MAX_BODY_BYTES} bytes')
+                return
+
+            try:
+                raw = read_body(self.rfile, content_length)
+                batch_id, variant, items = parse_items(raw, self.headers.get('Content-Type', ''))
+                ids = [item_id(item, index) for index, item in enumerate(items)]
+                if len(set(ids)) != len(ids):
+                    raise chat.ChatRequestError(400, 'Item ids must be unique within a batch')
+            except json.JSONDecodeError:
+                self.send_error_response(400, 'Invalid JSON in request body')
+                return
+            except ValueError as e:
+                self.send_error_response(400, str(e))
+                return
+            except chat.ChatRequestError as e:
+                self.send_error_response(e.status_code, e.message)
+                return
+
+            api_key = os.environ.get('OPENROUTER_API_KEY')
+            if not api_key:
+                self.send_error_response(500, 'API key not configured. Please set OPENROUTER_API_KEY environment variable.')
+                return
+
+            # Resume with ?batch_id=, the X-Batch-Id header or "batch_id" in the body
+            query = parse_qs(urlsplit(self.path).query)
+            batch_id = str(
+                (query.get('batch_id') or [None])[0] or self.headers.get('X-Batch-Id') or batch_id or uuid.uuid4().hex
+            )
+            self.extra_headers['X-Batch-Id'] = batch_id
+            client = chat.client_id(self.headers, self.client_address[0])
+
+            self.send_response(200)
+            self.send_cors_headers(NDJSON_CONTENT_TYPE)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+
+            results = []
+            lines = run_batch(api_key, batch_id, items, variant, client)
+            try:
+                for result in lines:
+                    results.append(result)
+                    self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+                self.wfile.write(json.dumps(batch_summary(batch_id, results)).encode('utf-8') + b'\n')
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away; completed items stay stored for a resume
+                return
+            finally:
+                lines.close()
+
+        except Exception as e:
+            self.send_error_response(500, f'Internal server error: {str(e)}')
@@ -3,10 +3,35 @@ Form Builder Bug Report - Chat API Handler
 Vercel Serverless Function for processing chat messages with OpenRouter API
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from contextlib import nullcontext
+import contextvars
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from http.server import BaseHTTPRequestHandler
+import hashlib
 import json
+import math
 import os
-import requests
+import random
+import threading
+import time
+from types import MappingProxyType
+import uuid
+
+from api._body import materialize_data_uris, parse_body, read_body
+from api._cache import cache_key, create_cache
+from api._images import has_images, process_images
+from api._metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from api._ratelimit import RateLimited, RateLimiter
+from api._report import (
+    ReportStreamGuard, build_repair_messages, format_report, merge_repair,
+    repair_targets, report_sections, validate_report
+)
+from api._routing import ModelRouter
+from api._singleflight import SingleFlight
+from api._timing import RequestTiming, write_log
+from api._tracing import SPAN_KIND_CLIENT, create_tracer, span as trace_span
 
 # System prompt for the QA Engineer AI
 SYSTEM_PROMPT = """You are a **professional QA engineer AI** specialized in generating **developer-ready bug reports** for a **low-code Form Builder platform**.
@@ -125,52 +150,1629 @@ Your audience is **developers**, not end users.
 You must **never** output anything except the structured bug report defined above.
 No explanations. No suggestions. No meta text."""
 
+# Compressed rewrite of SYSTEM_PROMPT with the same rules in far fewer tokens
+COMPACT_SYSTEM_PROMPT = """You are a QA engineer writing developer-ready bug reports for a low-code Form Builder platform (Form Builder, View App, Print Out, Data Model, Pages, Reports: Chart/Statistics).
+
+Rewrite the user's issue as a bug report. Output Markdown with ONLY these five sections, in this order, each label on its own line and this separator line between sections:
+
+Summary:
+_______________________________________________________
+
+Title:
+_______________________________________________________
+
+Reproduce Steps:
+_______________________________________________________
+
+Actual Result:
+_______________________________________________________
+
+Expected Result:
+
+Section rules:
+- Summary: 1-2 sentences on the issue and its impact.
+- Title: Area | Module | Component | Issue description
+- Reproduce Steps: numbered, deterministic steps; URLs only if the user gave them, in "double quotes".
+- Actual Result: bullets describing the incorrect behavior.
+- Expected Result: bullets describing the correct behavior, contrasting with Actual Result.
+
+Never add other text, sections, tables, solutions, assumptions, questions, image references, environment, severity or priority. Use neutral, concise QA language."""
+
 # OpenRouter API configuration
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+SITE_URL = os.environ.get('SITE_URL', 'https://form-builder-bug-report.vercel.app')
 MODEL = "allenai/molmo-2-8b:free"
 MAX_TOKENS = 1200
 TEMPERATURE = 0.0
 REQUEST_TIMEOUT = 60
 
+# Named system prompts; requests may pick one with "prompt_variant", otherwise
+# PROMPT_VARIANT_SPLIT weights them, e.g. "full:90,compact:10"
+PROMPT_VARIANTS = {
+    'full': SYSTEM_PROMPT,
+    'compact': COMPACT_SYSTEM_PROMPT
+}
+PROMPT_VARIANT_SPLIT = os.environ.get('PROMPT_VARIANT_SPLIT', 'full:100')
+
+# Model pool: MODEL leads the vision models; text models serve text-only requests
+FALLBACK_VISION_MODELS = [m.strip() for m in os.environ.get('FALLBACK_VISION_MODELS', '').split(',') if m.strip()]
+TEXT_MODELS = [m.strip() for m in os.environ.get('TEXT_MODELS', '').split(',') if m.strip()]
+MODEL_STATS_WINDOW = int(os.environ.get('MODEL_STATS_WINDOW', 50))
+MODEL_MAX_ERROR_RATE = float(os.environ.get('MODEL_MAX_ERROR_RATE', 0.5))
+
+# Model prefixes that only cache the prompt prefix when it carries an explicit
+# cache_control breakpoint; other providers cache long prefixes automatically
+PROMPT_CACHE_MODELS = [p.strip() for p in os.environ.get('PROMPT_CACHE_MODELS', 'anthropic/,google/gemini').split(',') if p.strip()]
+
+# Output budget: sized from the input between MAX_TOKENS_FLOOR and MAX_TOKENS,
+# with follow-up calls when a reply is cut off at the limit anyway
+ADAPTIVE_MAX_TOKENS = os.environ.get('ADAPTIVE_MAX_TOKENS', 'on') != 'off'
+MAX_TOKENS_FLOOR = int(os.environ.get('MAX_TOKENS_FLOOR', 400))
+MAX_CONTINUATIONS = int(os.environ.get('MAX_CONTINUATIONS', 2))
+REPORT_BASE_TOKENS = 300
+TOKENS_PER_IMAGE = 200
+CONTINUE_PROMPT = 'Continue the bug report exactly where it stopped. Do not repeat any earlier text.'
+
+# Report format enforcement: targeted repair of malformed sections, and
+# cutting streams off once the Expected Result section is complete
+REPORT_REPAIR = os.environ.get('REPORT_REPAIR', 'on') != 'off'
+REPORT_REPAIR_MAX_TOKENS = int(os.environ.get('REPORT_REPAIR_MAX_TOKENS', 400))
+REPORT_REPAIR_TIMEOUT = float(os.environ.get('REPORT_REPAIR_TIMEOUT', 15))
+REPORT_STREAM_CUTOFF = os.environ.get('REPORT_STREAM_CUTOFF', 'on') != 'off'
+
+# Circuit breaker per model: trips on errors or stalls, then probes after a cooldown
+CIRCUIT_BREAKER = os.environ.get('CIRCUIT_BREAKER', 'on') != 'off'
+CIRCUIT_WINDOW = int(os.environ.get('CIRCUIT_WINDOW', 20))
+CIRCUIT_MIN_SAMPLES = int(os.environ.get('CIRCUIT_MIN_SAMPLES', 5))
+CIRCUIT_MAX_ERROR_RATE = float(os.environ.get('CIRCUIT_MAX_ERROR_RATE', 0.5))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get('CIRCUIT_SLOW_CALL_SECONDS', 20.0))
+CIRCUIT_MAX_SLOW_RATE = float(os.environ.get('CIRCUIT_MAX_SLOW_RATE', 0.5))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 30.0))
+
+# Upstream statuses worth retrying on another model
+FALLBACK_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Retries after every candidate model failed, within the REQUEST_TIMEOUT budget
+RETRY_MAX_RETRIES = int(os.environ.get('RETRY_MAX_RETRIES', 2))
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 8.0))
+
+# Hedging: if no response headers arrive within the model's latency percentile,
+# race a second request and keep whichever answers first
+HEDGING = os.environ.get('UPSTREAM_HEDGING', 'off') == 'on'
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 0.95))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 1.0))
+HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', 5.0))
+HEDGE_MAX_WORKERS = int(os.environ.get('HEDGE_MAX_WORKERS', 0))
+STREAM_CONTENT_TYPE = 'text/event-stream'
+
+# Per-request phase timings, as a response header and one JSON log line on stderr
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'on') != 'off'
+REQUEST_LOG = os.environ.get('REQUEST_LOG', 'on') != 'off'
+
+# Sampled request tracing (mode: off, file or otlp)
+TRACING = os.environ.get('TRACING', 'off')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.05))
+TRACE_FILE = os.environ.get('TRACE_FILE', '/tmp/bug-report-traces.jsonl')
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'form-builder-bug-report')
+
+tracer = create_tracer(TRACING, TRACE_SAMPLE_RATE, TRACE_FILE, TRACE_OTLP_ENDPOINT, TRACE_SERVICE_NAME)
+
+
+def trace_request(name, traceparent):
+    """Root span for an incoming request; yields None when it is not traced"""
+    if tracer is None:
+        return nullcontext()
+    return tracer.request(name, traceparent)
+
+# CORS headers shared by every response
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, X-Batch-Id, traceparent, tracestate'),
+    ('Access-Control-Expose-Headers', 'Retry-After, Server-Timing, X-Batch-Id, X-Cache, X-Coalesced, X-Conversation-Id, X-Image-Bytes-Before, X-Image-Bytes-After, X-Cached-Tokens, X-Continuations, X-Max-Tokens, X-Model, X-Prompt-Tokens, X-Prompt-Variant, X-Report-Repair, X-Request-Id, X-Retry-Count, X-Upstream-Attempts'),
+    ('Timing-Allow-Origin', '*')
+]
+MAX_BODY_BYTES = int(os.environ.get('MAX_BODY_BYTES', 32 * 1024 * 1024))
+
+# Screenshot processing (longest side in pixels, WEBP or JPEG, encoder quality)
+IMAGE_PROCESSING = os.environ.get('IMAGE_PROCESSING', 'on') != 'off'
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 1536))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'WEBP').upper()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 25_000_000))
+
+# Upstream connection pool configuration
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get('UPSTREAM_POOL_CONNECTIONS', 2))
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 10))
+
+
+def create_upstream_session():
+    """Create a keep-alive session backed by a bounded connection pool"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=UPSTREAM_POOL_MAXSIZE
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_upstream_pool_stats():
+    """Summarize connection reuse across all pooled upstream hosts"""
+    stats = {'requests': 0, 'connections': 0, 'reused': 0}
+    if upstream_session is None:
+        return stats
+    adapter = upstream_session.get_adapter(OPENROUTER_API_URL)
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        stats['requests'] += pool.num_requests
+        stats['connections'] += pool.num_connections
+    stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+    return stats
+
+
+# Created once per process so warm invocations skip DNS, TCP and TLS setup.
+# Importing requests and urllib3 is the largest part of a cold start, so the
+# session waits for the first model call instead of module load.
+upstream_session = None
+upstream_session_lock = threading.Lock()
+
+
+def get_upstream_session():
+    """The shared upstream session, created on first use"""
+    global upstream_session
+    if upstream_session is None:
+        with upstream_session_lock:
+            if upstream_session is None:
+                upstream_session = create_upstream_session()
+    return upstream_session
+
+# Shared across requests so routing learns from every upstream call
+model_router = ModelRouter(
+    [MODEL] + FALLBACK_VISION_MODELS,
+    TEXT_MODELS,
+    window=MODEL_STATS_WINDOW,
+    max_error_rate=MODEL_MAX_ERROR_RATE,
+    breaker={
+        'window': CIRCUIT_WINDOW,
+        'min_samples': CIRCUIT_MIN_SAMPLES,
+        'max_error_rate': CIRCUIT_MAX_ERROR_RATE,
+        'slow_call_seconds': CIRCUIT_SLOW_CALL_SECONDS,
+        'max_slow_rate': CIRCUIT_MAX_SLOW_RATE,
+        'open_seconds': CIRCUIT_OPEN_SECONDS,
+        'probe_timeout': REQUEST_TIMEOUT
+    } if CIRCUIT_BREAKER else None
+)
+
+# Response cache configuration (backend: memory, sqlite, redis or none)
+CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256))
+CACHE_SQLITE_PATH = os.environ.get('RESPONSE_CACHE_PATH', '/tmp/bug-report-cache.sqlite3')
+CACHE_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Only deterministic completions are safe to replay from cache
+response_cache = create_cache(
+    CACHE_BACKEND,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL,
+    sqlite_path=CACHE_SQLITE_PATH,
+    redis_url=CACHE_REDIS_URL
+) if TEMPERATURE == 0 else None
+
+
+def response_cache_key(system_prompt, messages):
+    """Cache key for a report from whichever model the request is routed to"""
+    return cache_key(model_router.pool(has_images(messages)), system_prompt, MAX_TOKENS, TEMPERATURE, messages)
+
+
+def cache_lookup(key):
+    """Fetch a cached completion body, treating backend failures as misses"""
+    if response_cache is None:
+        return None
+    try:
+        return response_cache.get(key)
+    except Exception:
+        return None
+
+
+def cache_store(key, completion_body):
+    """Store a raw completion body, ignoring backend failures"""
+    if response_cache is None:
+        return
+    try:
+        response_cache.set(key, completion_body)
+    except Exception:
+        pass
+
+
+def slim_completion(completion_body):
+    """Reduce a completion body to the assistant text and token usage"""
+    completion = json.loads(completion_body)
+    return {
+        'content': completion['choices'][0]['message']['content'],
+        'usage': completion.get('usage')
+    }
+
+
+# Prometheus metrics for this process, served at /api/metrics when self-hosting
+METRICS = os.environ.get('METRICS', 'on') != 'off'
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 32 * 1024 * 1024)
+
+metrics = Registry()
+requests_total = metrics.counter('bug_report_requests_total', 'Chat requests by response status', ('status',))
+requests_in_flight = metrics.gauge('bug_report_requests_in_flight', 'Chat requests being handled')
+request_seconds = metrics.histogram('bug_report_request_duration_seconds', 'Chat request time from arrival to last byte', LATENCY_BUCKETS)
+upstream_seconds = metrics.histogram('bug_report_upstream_duration_seconds', 'Time waiting on the model, including retries and repair', LATENCY_BUCKETS)
+ttft_seconds = metrics.histogram('bug_report_time_to_first_token_seconds', 'Time until the first streamed token is sent', LATENCY_BUCKETS)
+request_bytes = metrics.histogram('bug_report_request_bytes', 'Chat request body size', SIZE_BUCKETS)
+response_bytes = metrics.histogram('bug_report_response_bytes', 'Chat response body size', SIZE_BUCKETS)
+cache_lookups = metrics.counter('bug_report_cache_lookups_total', 'Response cache lookups by result', ('result',))
+cache_hit_ratio = metrics.gauge('bug_report_cache_hit_ratio', 'Share of response cache lookups that hit')
+upstream_calls = metrics.counter('bug_report_upstream_requests_total', 'Calls to the model by model and status', ('model', 'status'))
+tokens_total = metrics.counter('bug_report_tokens_total', 'Tokens reported by the upstream', ('type',))
+
+# Token totals for completions generated by this process
+token_stats = {'completions': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+token_lock = threading.Lock()
+
+
+def usage_summary(usage):
+    """Prompt, cached prompt and completion token counts from a usage block"""
+    usage = usage or {}
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'cached_tokens': details.get('cached_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0
+    }
+
+
+def completion_usage(completion_body):
+    """Token counts from a completion body's usage block"""
+    try:
+        usage = json.loads(completion_body).get('usage')
+    except (ValueError, AttributeError):
+        usage = None
+    return usage_summary(usage)
+
+
+def record_usage(completion_body):
+    """Add a completion's token usage to the process totals and return it"""
+    summary = completion_usage(completion_body)
+    with token_lock:
+        token_stats['completions'] += 1
+        for key, value in summary.items():
+            token_stats[key] += value
+    for key, value in summary.items():
+        tokens_total.inc(value, type=key.replace('_tokens', ''))
+    return summary
+
+
+def get_token_stats():
+    """Token totals plus the share of prompt tokens served from the provider cache"""
+    with token_lock:
+        stats = dict(token_stats)
+    stats['cached_ratio'] = round(stats['cached_tokens'] / stats['prompt_tokens'], 3) if stats['prompt_tokens'] else 0.0
+    return stats
+
+
+# Concurrent identical requests share one upstream call
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', 'on') != 'off'
+single_flight = SingleFlight()
+
+
+def wait_for_leader(future):
+    """Wait for a coalesced request's leader, returning None if it failed"""
+    try:
+        return future.result(timeout=COALESCE_TIMEOUT)
+    except FutureTimeout:
+        return None
+
+
+# Admission control in front of the upstream (requests per minute; 0 disables)
+RATE_LIMIT_GLOBAL_RPM = float(os.environ.get('RATE_LIMIT_GLOBAL_RPM', 20))
+RATE_LIMIT_GLOBAL_BURST = int(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 5))
+RATE_LIMIT_CLIENT_RPM = float(os.environ.get('RATE_LIMIT_CLIENT_RPM', 6))
+RATE_LIMIT_CLIENT_BURST = int(os.environ.get('RATE_LIMIT_CLIENT_BURST', 3))
+RATE_LIMIT_MAX_QUEUE = int(os.environ.get('RATE_LIMIT_MAX_QUEUE', 20))
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 30))
+# X-Forwarded-For can be forged unless a proxy sets it; Vercel does, and sets VERCEL=1
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'on' if os.environ.get('VERCEL') else 'off') == 'on'
+
+# A leader may queue behind the rate limiter, then spend the whole upstream budget
+COALESCE_TIMEOUT = RATE_LIMIT_MAX_WAIT + REQUEST_TIMEOUT
+
+rate_limiter = RateLimiter(
+    RATE_LIMIT_GLOBAL_RPM / 60,
+    RATE_LIMIT_GLOBAL_BURST,
+    RATE_LIMIT_CLIENT_RPM / 60,
+    RATE_LIMIT_CLIENT_BURST,
+    RATE_LIMIT_MAX_QUEUE,
+    RATE_LIMIT_MAX_WAIT
+)
+
+
+def client_id(headers, peer_address):
+    """Identify the client for rate limiting, honoring a trusted proxy's X-Forwarded-For"""
+    if TRUST_PROXY_HEADERS:
+        # Header lookups are case-insensitive for http.server; ASGI names are lowercase
+        forwarded = headers.get('x-forwarded-for')
+        if forwarded:
+            # The proxy appends the address it saw; earlier entries come from the client
+            return forwarded.split(',')[-1].strip()
+    return peer_address
+
+
+# Conversation sessions let clients send only the newest turn
+CONVERSATION_BACKEND = os.environ.get('CONVERSATION_BACKEND', 'memory')
+CONVERSATION_TTL = int(os.environ.get('CONVERSATION_TTL', 1800))
+CONVERSATION_MAX_ENTRIES = int(os.environ.get('CONVERSATION_MAX_ENTRIES', 128))
+
+conversation_store = create_cache(
+    CONVERSATION_BACKEND,
+    CONVERSATION_MAX_ENTRIES,
+    CONVERSATION_TTL,
+    sqlite_path=CACHE_SQLITE_PATH,
+    redis_url=CACHE_REDIS_URL,
+    namespace='conversations'
+)
+
+
+def load_conversation(conversation_id):
+    """Return the stored history for a conversation, or None if unknown"""
+    if conversation_store is None:
+        return None
+    try:
+        stored = conversation_store.get(conversation_id)
+        return json.loads(stored) if stored is not None else None
+    except Exception:
+        return None
+
+
+def save_conversation(conversation_id, messages, completion_body):
+    """Append the assistant reply and persist the conversation history"""
+    if conversation_store is None or conversation_id is None:
+        return
+    try:
+        content = json.loads(completion_body)['choices'][0]['message']['content']
+        history = messages + [{
+            'role': 'assistant',
+            'content': [{'type': 'text', 'text': content}]
+        }]
+        conversation_store.set(conversation_id, json.dumps(history).encode('utf-8'))
+    except Exception:
+        pass
+
+
+class ChatRequestError(Exception):
+    """A request problem reported to the client with an HTTP status code
+
+    retryable marks upstream failures that another attempt might avoid;
+    retry_after carries the upstream's Retry-After hint in seconds.
+    """
+
+    def __init__(self, status_code, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def prepare_images(messages, extra_headers):
+    """Shrink screenshots in new messages, or decode them when processing is off"""
+    if not IMAGE_PROCESSING:
+        return materialize_data_uris(messages)
+    messages, image_stats = process_images(
+        messages, IMAGE_MAX_DIMENSION, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_PIXELS
+    )
+    if image_stats['images']:
+        extra_headers['X-Image-Bytes-Before'] = str(image_stats['bytes_before'])
+        extra_headers['X-Image-Bytes-After'] = str(image_stats['bytes_after'])
+    return messages
+
+
+def resolve_messages(body, extra_headers):
+    """Resolve the full message history for a request
+
+    Accepts either a full messages array or a single new turn for a stored
+    conversation. Returns (messages, conversation_id) and records response
+    headers describing the work done in extra_headers.
+    """
+    messages = body.get('messages', [])
+    history = []
+    conversation_id = body.get('conversation_id')
+    if conversation_id:
+        if not body.get('message'):
+            raise ChatRequestError(400, 'No message provided for conversation')
+        history = load_conversation(str(conversation_id))
+        if history is None:
+            raise ChatRequestError(409, 'Unknown or expired conversation. Resend the full message history.')
+        messages = [body['message']]
+    elif body.get('message'):
+        messages = [body['message']]
+
+    if not messages:
+        raise ChatRequestError(400, 'No messages provided in request')
+
+    # Shrink new screenshots; stored history was already processed
+    messages = history + prepare_images(messages, extra_headers)
+
+    # Full-history requests start a new server-side conversation
+    if conversation_store is not None:
+        if not conversation_id:
+            conversation_id = uuid.uuid4().hex
+        extra_headers['X-Conversation-Id'] = conversation_id
+
+    return messages, conversation_id
+
+
+def parse_variant_split(value):
+    """Parse "name:weight,..." into (variant, weight) pairs, ignoring unknown names"""
+    split = []
+    for item in value.split(','):
+        name, _, weight = item.strip().partition(':')
+        if name in PROMPT_VARIANTS:
+            split.append((name, max(int(weight or 1), 0)))
+    return split or [('full', 1)]
+
+
+prompt_variant_split = parse_variant_split(PROMPT_VARIANT_SPLIT)
+
+
+def choose_prompt_variant(requested, sticky_key=None):
+    """Pick the system prompt variant for a request
+
+    An explicitly requested variant wins. Otherwise the traffic split
+    decides, hashing sticky_key (the conversation id) when there is one so
+    every turn of a conversation sees the same prompt.
+    """
+    if requested is not None:
+        if requested not in PROMPT_VARIANTS:
+            raise ChatRequestError(400, f'Unknown prompt_variant. Choose one of: {", ".join(PROMPT_VARIANTS)}')
+        return requested
+
+    total = sum(weight for _, weight in prompt_variant_split)
+    if total == 0:
+        return 'full'
+    if sticky_key:
+        point = int(hashlib.sha256(str(sticky_key).encode('utf-8')).hexdigest()[:8], 16) % total
+    else:
+        point = random.randrange(total)
+    for name, weight in prompt_variant_split:
+        if point < weight:
+            return name
+        point -= weight
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return math.ceil(len(text) / 4)
+
+
+def content_parts(msg):
+    """Text and image counts of a message's content"""
+    content = msg.get('content') if isinstance(msg, dict) else None
+    if isinstance(content, str):
+        return content, 0
+    if not isinstance(content, list):
+        return '', 0
+    text = ' '.join(part.get('text') or '' for part in content if isinstance(part, dict) and part.get('type') == 'text')
+    images = sum(1 for part in content if isinstance(part, dict) and part.get('type') == 'image_url')
+    return text, images
+
+
+def choose_max_tokens(messages):
+    """Output budget for a request, sized from its newest turns
+
+    A report restates the latest description in structured form, so its
+    length tracks that message; screenshots add detail to describe, and a
+    follow-up revises the previous report, which is counted too.
+    """
+    if not ADAPTIVE_MAX_TOKENS:
+        return MAX_TOKENS
+
+    def latest(role):
+        return next((m for m in reversed(messages) if isinstance(m, dict) and m.get('role', 'user') == role), {})
+
+    text, images = content_parts(latest('user'))
+    previous, _ = content_parts(latest('assistant'))
+    estimate = REPORT_BASE_TOKENS + 2 * estimate_tokens(text) + TOKENS_PER_IMAGE * images + estimate_tokens(previous)
+    return max(MAX_TOKENS_FLOOR, min(MAX_TOKENS, estimate))
+
+
+def continuation_messages(api_messages, partial):
+    """Messages asking the model to pick up a reply cut off at max_tokens"""
+    return api_messages + [
+        {'role': 'assistant', 'content': partial},
+        {'role': 'user', 'content': CONTINUE_PROMPT}
+    ]
+
+
+def merge_usage(first, second):
+    """Sum two usage blocks, including nested token details"""
+    merged = dict(first or {})
+    for key, value in (second or {}).items():
+        if isinstance(value, dict):
+            merged[key] = merge_usage(merged.get(key), value)
+        elif isinstance(value, (int, float)) and isinstance(merged.get(key, 0), (int, float)):
+            merged[key] = merged.get(key, 0) + value
+        else:
+            merged[key] = value
+    return merged
+
+
+def extend_completion(completion, continuation_body):
+    """Append a continuation reply to a truncated completion in place
+
+    Returns False when the continuation is unusable.
+    """
+    try:
+        extra = json.loads(continuation_body)
+        text = extra['choices'][0]['message']['content'] or ''
+    except (ValueError, KeyError, IndexError, TypeError):
+        return False
+    choice = completion['choices'][0]
+    choice['message']['content'] = (choice['message'].get('content') or '') + text
+    choice['finish_reason'] = extra['choices'][0].get('finish_reason')
+    completion['usage'] = merge_usage(completion.get('usage'), extra.get('usage'))
+    return True
+
+
+def build_system_message(system_prompt, cache_breakpoint=False):
+    if cache_breakpoint:
+        # Cache breakpoint right after the shared system prompt prefix
+        content = [{'type': 'text', 'text': system_prompt, 'cache_control': {'type': 'ephemeral'}}]
+        return {'role': 'system', 'content': content}
+    return {'role': 'system', 'content': system_prompt}
+
+
+# Request skeleton built once at module load: the headers every upstream call
+# shares and the system message of each prompt variant, with and without a
+# cache breakpoint. Requests reference these rather than copy them, so they
+# must never be mutated.
+UPSTREAM_HEADERS = MappingProxyType({
+    'Content-Type': 'application/json',
+    'HTTP-Referer': SITE_URL,
+    'X-Title': 'Form Builder Bug Report'
+})
+SYSTEM_MESSAGES = MappingProxyType({
+    (prompt, cache_breakpoint): build_system_message(prompt, cache_breakpoint)
+    for prompt in PROMPT_VARIANTS.values()
+    for cache_breakpoint in (False, True)
+})
+
+
+def system_message(system_prompt, cache_breakpoint=False):
+    """Prebuilt system message for a known prompt, or a new one for any other"""
+    message = SYSTEM_MESSAGES.get((system_prompt, cache_breakpoint))
+    return message if message is not None else build_system_message(system_prompt, cache_breakpoint)
+
+
+def build_api_messages(messages, system_prompt=SYSTEM_PROMPT):
+    """Prepend the system prompt and normalize message content to arrays"""
+    api_messages = [system_message(system_prompt)]
+
+    for msg in messages:
+        role = msg.get('role', 'user')
+        content = msg.get('content', [])
+
+        # Handle content array format
+        if isinstance(content, list):
+            api_messages.append({
+                'role': role,
+                'content': content
+            })
+        else:
+            # Handle simple string content
+            api_messages.append({
+                'role': role,
+                'content': [{'type': 'text', 'text': str(content)}]
+            })
+
+    return api_messages
+
+
+def supports_prompt_cache(model):
+    """Whether the model needs cache_control markers to cache the prompt"""
+    return any(model.startswith(prefix) for prefix in PROMPT_CACHE_MODELS)
+
+
+def build_upstream_request(api_key, api_messages, stream, model=MODEL, max_tokens=MAX_TOKENS):
+    """Build the OpenRouter headers and JSON payload
+
+    The headers are a fresh dict, so callers may add to them.
+    """
+    headers = {'Authorization': f'Bearer {api_key}', **UPSTREAM_HEADERS}
+
+    system = api_messages[0] if api_messages else {}
+    if supports_prompt_cache(model) and system.get('role') == 'system' and isinstance(system.get('content'), str):
+        api_messages = [system_message(system['content'], True)] + api_messages[1:]
+
+    payload = {
+        'model': model,
+        'messages': api_messages,
+        'max_tokens': max_tokens,
+        'temperature': TEMPERATURE,
+        # Ask for cached prompt token counts in the usage block
+        'usage': {'include': True}
+    }
+    if stream:
+        payload['stream'] = True
+
+    return headers, payload
+
+
+def upstream_error_message(body):
+    """Describe a failed upstream response from its raw body"""
+    try:
+        error_data = json.loads(body)
+        error_detail = error_data.get('error', {}).get('message', str(error_data))
+    except Exception:
+        error_detail = body[:200].decode('utf-8', 'replace') if body else 'No error details'
+    return f'AI service error: {error_detail}'
+
+
+# Events that end a stream cut short by the report guard
+STREAM_STOP_LINES = [
+    b'',
+    b'data: {"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}',
+    b'',
+    b'data: [DONE]',
+    b''
+]
+
+
+class StreamCollector:
+    """Assembles a chat.completion from streamed SSE data lines
+
+    With a ReportStreamGuard it also decides what reaches the client: text
+    past the end of the report is withheld and the stream is ended early.
+    """
+
+    def __init__(self, guard=None, continuable=False):
+        self.completion = {
+            'object': 'chat.completion',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''},
+                'finish_reason': None
+            }]
+        }
+        self.parts = []
+        self.failed = False
+        self.guard = guard
+        self.stopped = False
+        # A truncated stream may be continued, so its [DONE] is held back
+        self.continuable = continuable
+        self.done_withheld = False
+
+    def feed(self, line):
+        """Fold one SSE line into the completion; return the lines to forward"""
+        if not line.startswith(b'data:'):
+            return [line]
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            self.done_withheld = self.continuable and self.truncated()
+            return [] if self.done_withheld else [line]
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            return [line]
+        if 'error' in chunk:
+            self.failed = True
+            return [line]
+
+        for key in ('id', 'model', 'created'):
+            if key in chunk:
+                self.completion[key] = chunk[key]
+        if chunk.get('usage'):
+            self.completion['usage'] = merge_usage(self.completion.get('usage'), chunk['usage'])
+
+        choices = chunk.get('choices') or [{}]
+        delta = choices[0].get('delta') or {}
+        text = delta.get('content') or ''
+        finish_reason = choices[0].get('finish_reason')
+        forward = [line]
+
+        if self.guard is not None:
+            released = self.guard.feed(text) if text else ''
+            if released != text:
+                # Forward only the released text, re-encoded in the same event shape
+                choices[0]['delta'] = dict(delta, content=released)
+                forward = [b'data: ' + json.dumps(chunk).encode('utf-8')] if released or finish_reason else []
+                text = released
+            if self.guard.done:
+                self.stopped = True
+                finish_reason = 'stop'
+                forward += STREAM_STOP_LINES
+                # The stop lines end with their own [DONE]
+                self.done_withheld = False
+
+        if text:
+            self.parts.append(text)
+        if finish_reason:
+            self.completion['choices'][0]['finish_reason'] = finish_reason
+        return forward
+
+    def truncated(self):
+        return self.completion['choices'][0]['finish_reason'] == 'length'
+
+    def text(self):
+        return ''.join(self.parts)
+
+    def result(self):
+        """Return the encoded completion, or None if the upstream failed"""
+        if self.failed:
+            return None
+        self.completion['choices'][0]['message']['content'] = ''.join(self.parts)
+        return json.dumps(self.completion).encode('utf-8')
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(retry, retry_after=None):
+    """Exponential backoff with full jitter, never shorter than Retry-After"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (retry - 1)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+# The upstream pipeline (fallback and retry, hedging, continuation and
+# repair) is written once, as generator "plans" that yield the I/O they need
+# and receive its result: Send posts one request to OpenRouter, Sleep waits
+# out a backoff and Race hedges a slow attempt with a second one. run_plan()
+# performs them with blocking I/O for the http.server handlers; server/asgi.py
+# performs the same plans with httpx and asyncio.
+
+class Send:
+    """POST one request to OpenRouter; answered with an UpstreamReply"""
+
+    __slots__ = ('headers', 'payload', 'stream', 'timeout')
+
+    def __init__(self, headers, payload, stream, timeout):
+        self.headers = headers
+        self.payload = payload
+        self.stream = stream
+        self.timeout = timeout
+
+
+class Sleep:
+    """Wait before the next step"""
+
+    __slots__ = ('delay',)
+
+    def __init__(self, delay):
+        self.delay = delay
+
+
+class Race:
+    """Run the first plan; if it is still running after delay, start second() too
+
+    Answered with (reply, index) of the first plan to succeed, or raises
+    the last error when both fail. The loser's reply is closed.
+    """
+
+    __slots__ = ('first', 'second', 'delay')
+
+    def __init__(self, first, second, delay):
+        self.first = first
+        self.second = second
+        self.delay = delay
+
+
+class Relay:
+    """Forward a streamed response through the collector to the client"""
+
+    __slots__ = ('response', 'collector')
+
+    def __init__(self, response, collector):
+        self.response = response
+        self.collector = collector
+
+
+class UpstreamReply:
+    """Outcome of a Send
+
+    elapsed stops at the response headers, so it is comparable between
+    streamed and buffered calls. body holds the full body, except for a
+    successful stream, which is left open in response for the caller.
+    """
+
+    __slots__ = ('status_code', 'headers', 'elapsed', 'body', 'response')
+
+    def __init__(self, status_code, headers, elapsed, body, response):
+        self.status_code = status_code
+        self.headers = headers
+        self.elapsed = elapsed
+        self.body = body
+        self.response = response
+
+
+class UpstreamTimeout(Exception):
+    """Raised into a plan when a Send times out"""
+
+
+class UpstreamUnreachable(Exception):
+    """Raised into a plan when a Send fails before a response arrives"""
+
+
+def run_plan(plan, relay=None):
+    """Drive a plan with blocking I/O and return its result
+
+    relay(op) performs Relay steps, which need the client connection.
+    """
+    result = error = None
+    while True:
+        try:
+            op = plan.send(result) if error is None else plan.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result = error = None
+        try:
+            if isinstance(op, Send):
+                result = send_upstream(op)
+            elif isinstance(op, Sleep):
+                time.sleep(op.delay)
+            elif isinstance(op, Race):
+                result = race(op)
+            else:
+                relay(op)
+        except BaseException as e:
+            # Raised inside the plan, so its spans and handlers see it
+            error = e
+
+
+def send_upstream(op):
+    """Perform a Send with the pooled requests session"""
+    # Deferred with the session; already loaded after the first call
+    import requests
+
+    try:
+        response = get_upstream_session().post(
+            OPENROUTER_API_URL,
+            headers=op.headers,
+            json=op.payload,
+            timeout=op.timeout,
+            stream=op.stream
+        )
+        body = None
+        if response.status_code != 200 or not op.stream:
+            body = response.content
+            response.close()
+    except requests.exceptions.Timeout:
+        raise UpstreamTimeout()
+    except requests.exceptions.RequestException as e:
+        raise UpstreamUnreachable(str(e))
+    return UpstreamReply(response.status_code, response.headers, response.elapsed.total_seconds(), body, response)
+
+
+def close_discarded(future):
+    """Release the connection held by a hedge race loser"""
+    try:
+        future.result().response.close()
+    except Exception:
+        pass
+
+
+def race(op):
+    """Perform a Race on the hedge pool"""
+    started = threading.Event()
+
+    def run_first():
+        started.set()
+        return run_plan(op.first)
+
+    # Run attempts in this request's context so their spans join its trace
+    first = hedge_executor.submit(contextvars.copy_context().run, run_first)
+    # Time spent queued for a pool thread is not upstream latency
+    started.wait()
+    try:
+        return first.result(timeout=op.delay), 0
+    except FutureTimeout:
+        pass
+
+    second = hedge_executor.submit(contextvars.copy_context().run, run_plan, op.second())
+    pending = {first: 0, second: 1}
+    error = None
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                reply = future.result()
+            except ChatRequestError as e:
+                error = e
+                continue
+
+            for loser in pending:
+                loser.add_done_callback(close_discarded)
+            return reply, index
+
+    raise error
+
+
+def time_left(deadline, limit=REQUEST_TIMEOUT):
+    """Timeout for the next upstream call, at most limit; raises a 504 once deadline passes"""
+    remaining = min(limit, deadline - time.monotonic())
+    if remaining <= 0:
+        raise ChatRequestError(504, 'Request to AI service timed out')
+    return remaining
+
+
+def admit_call(client, deadline, limiter=None):
+    """Plan: queue a follow-up upstream call behind the rate limiter
+
+    Raises ChatRequestError when the limiter cannot admit the call before
+    the request's deadline. limiter defaults to the interactive one.
+    """
+    limiter = limiter or rate_limiter
+    try:
+        delay = limiter.admit(client, max_wait=deadline - time.monotonic())
+    except RateLimited as e:
+        raise ChatRequestError(429, 'Too many requests. Please retry shortly.', retry_after=e.retry_after)
+    if delay:
+        try:
+            yield Sleep(delay)
+        finally:
+            limiter.release()
+
+
+def request_model(model, api_key, api_messages, stream, timeout=REQUEST_TIMEOUT, max_tokens=MAX_TOKENS):
+    """Plan: call one model and record the outcome with the router
+
+    Returns the UpstreamReply on HTTP 200, otherwise raises
+    ChatRequestError.
+    """
+    if not model_router.allow(model):
+        # Half-open breaker whose single probe is already in flight
+        raise ChatRequestError(503, f'Circuit open for {model}', retryable=True)
+
+    recorded = False
+    try:
+        with trace_span('openrouter', SPAN_KIND_CLIENT, **{'gen_ai.request.model': model, 'stream': stream}) as attempt:
+            headers, payload = build_upstream_request(api_key, api_messages, stream, model, max_tokens)
+            if attempt is not None:
+                # Lets a tracing upstream join the caller's trace
+                headers['traceparent'] = attempt.traceparent()
+            started = time.monotonic()
+            try:
+                reply = yield Send(headers, payload, stream, timeout)
+            except UpstreamTimeout:
+                model_router.record(model, time.monotonic() - started, False)
+                recorded = True
+                upstream_calls.inc(model=model, status='timeout')
+                raise ChatRequestError(504, 'Request to AI service timed out', retryable=True)
+            except UpstreamUnreachable as e:
+                model_router.record(model, time.monotonic() - started, False)
+                recorded = True
+                upstream_calls.inc(model=model, status='error')
+                raise ChatRequestError(502, f'Failed to connect to AI service: {str(e)}', retryable=True)
+
+            upstream_calls.inc(model=model, status=reply.status_code)
+            if attempt is not None:
+                attempt.set(**{'http.response.status_code': reply.status_code})
+                if reply.status_code != 200:
+                    attempt.fail(f'HTTP {reply.status_code}')
+
+        if reply.status_code == 200:
+            model_router.record(model, reply.elapsed, True)
+            recorded = True
+            return reply
+
+        retryable = reply.status_code in FALLBACK_STATUSES
+        if retryable:
+            model_router.record(model, time.monotonic() - started, False)
+            recorded = True
+        raise ChatRequestError(
+            reply.status_code,
+            upstream_error_message(reply.body),
+            retryable,
+            parse_retry_after(reply.headers.get('Retry-After'))
+        )
+    finally:
+        if not recorded:
+            # Client errors, crashes and cancelled hedges say nothing about
+            # the model, but a half-open probe must not stay reserved
+            model_router.release(model)
+
+
+def plan_report_repair(completion_body):
+    """Check a completion's report and work out what needs fixing
+
+    Returns None when the report is valid or too far gone for a targeted
+    repair, otherwise (completion, sections, targets) where targets are
+    the sections the model must rewrite; no targets means reformatting
+    alone fixes the report.
+    """
+    try:
+        completion = json.loads(completion_body)
+        content = completion['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    if not isinstance(content, str) or not validate_report(content):
+        return None
+
+    sections = report_sections(content)
+    # With most sections missing, a repair would amount to a full regeneration
+    if len(sections) < 3:
+        return None
+    return completion, sections, repair_targets(sections)
+
+
+def finish_report_repair(completion, sections):
+    """Encode the completion with its report rebuilt from sections"""
+    completion['choices'][0]['message']['content'] = format_report(sections)
+    return json.dumps(completion).encode('utf-8')
+
+
+def repair_reply(completion_body):
+    """Text of a repair completion, counted towards token usage"""
+    record_usage(completion_body)
+    try:
+        return json.loads(completion_body)['choices'][0]['message']['content'] or ''
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ''
+
+
+# Hedge counters and the pool that runs racing requests
+hedge_stats = {'issued': 0, 'won': 0}
+hedge_lock = threading.Lock()
+hedge_executor = None
+
+
+def configure_hedging(request_threads):
+    """Size the hedge pool for this many requests served at once
+
+    Each hedged request runs its first attempt and possibly a hedge on the
+    pool, and a race's loser keeps its thread until its call returns, so
+    the pool gets room for two races per request thread unless
+    HEDGE_MAX_WORKERS sets its size.
+    """
+    global hedge_executor
+    if not HEDGING:
+        return
+    previous = hedge_executor
+    hedge_executor = ThreadPoolExecutor(
+        max_workers=HEDGE_MAX_WORKERS or 4 * request_threads,
+        thread_name_prefix='hedge'
+    )
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+# A serverless instance serves one request at a time
+configure_hedging(1)
+
+
+def hedge_delay(model):
+    """Seconds to wait for the first attempt before issuing a hedge"""
+    delay = model_router.latency_percentile(model, HEDGE_PERCENTILE)
+    if delay is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(delay, HEDGE_MIN_DELAY)
+
+
+def request_hedged(model, fallbacks, api_key, api_messages, stream, deadline, max_tokens=MAX_TOKENS):
+    """Plan: race a hedge against a slow first attempt
+
+    The hedge goes to the next fallback model (consumed from fallbacks) or
+    to the same model when none is left. Each attempt's timeout is the time
+    left before deadline when it starts. Returns (reply, model) from
+    whichever attempt succeeds first.
+    """
+    models = [model]
+
+    def attempt(index):
+        return (yield from request_model(
+            models[index], api_key, api_messages, stream, time_left(deadline), max_tokens
+        ))
+
+    def hedge():
+        models.append(fallbacks.pop(0) if fallbacks else model)
+        with hedge_lock:
+            hedge_stats['issued'] += 1
+        return attempt(1)
+
+    reply, index = yield Race(attempt(0), hedge, min(hedge_delay(model), time_left(deadline)))
+    if index:
+        with hedge_lock:
+            hedge_stats['won'] += 1
+    return reply, models[index]
+
+
+def call_upstream(api_key, messages, stream, extra_headers, system_prompt=SYSTEM_PROMPT, deadline=None):
+    """Plan: send the request to the fastest healthy model, falling back on failure
+
+    Each pass tries every candidate model in order. When all of them fail
+    with retryable errors, the pass is repeated after a backoff, up to
+    RETRY_MAX_RETRIES times and before deadline (by default REQUEST_TIMEOUT
+    from now). Models with an open circuit breaker are skipped, and when
+    none are left the request fails fast with a 503. Returns the first
+    successful UpstreamReply; raises ChatRequestError otherwise.
+    """
+    api_messages = build_api_messages(messages, system_prompt)
+    max_tokens = choose_max_tokens(messages)
+    extra_headers['X-Max-Tokens'] = str(max_tokens)
+    if deadline is None:
+        deadline = time.monotonic() + REQUEST_TIMEOUT
+    attempts = 0
+    retries = 0
+
+    try:
+        while True:
+            candidates = model_router.candidates(has_images(messages))
+            if not candidates:
+                retry_after = model_router.reopen_delay(has_images(messages))
+                extra_headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                raise ChatRequestError(503, 'AI service is temporarily unavailable, please retry shortly')
+
+            error = None
+            while candidates:
+                model = candidates.pop(0)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise error or ChatRequestError(504, 'Request to AI service timed out')
+
+                attempts += 1
+                try:
+                    if HEDGING:
+                        reply, model = yield from request_hedged(
+                            model, candidates, api_key, api_messages, stream, deadline, max_tokens
+                        )
+                    else:
+                        reply = yield from request_model(model, api_key, api_messages, stream, timeout, max_tokens)
+                except ChatRequestError as e:
+                    if not e.retryable:
+                        raise
+                    error = e
+                    continue
+
+                extra_headers['X-Model'] = model
+                return reply
+
+            # Every candidate failed; back off unless the budget is spent
+            if retries >= RETRY_MAX_RETRIES:
+                raise error
+            delay = retry_delay(retries + 1, error.retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise error
+            yield Sleep(delay)
+            retries += 1
+    finally:
+        extra_headers['X-Upstream-Attempts'] = str(attempts)
+        extra_headers['X-Retry-Count'] = str(retries)
+
+
+def continue_completion(completion_body, continue_reply, extra_headers):
+    """Plan: extend a reply cut off at max_tokens with up to MAX_CONTINUATIONS calls"""
+    try:
+        completion = json.loads(completion_body)
+        truncated = completion['choices'][0].get('finish_reason') == 'length'
+    except (ValueError, KeyError, IndexError, TypeError):
+        return completion_body
+    if not truncated:
+        return completion_body
+
+    continuations = 0
+    while completion['choices'][0].get('finish_reason') == 'length' and continuations < MAX_CONTINUATIONS:
+        try:
+            reply = yield from continue_reply(completion['choices'][0]['message'].get('content') or '')
+        except ChatRequestError:
+            break
+        if not extend_completion(completion, reply.body):
+            break
+        continuations += 1
+
+    if not continuations:
+        return completion_body
+    extra_headers['X-Continuations'] = str(continuations)
+    return json.dumps(completion).encode('utf-8')
+
+
+def relay_report(reply, collector, continue_stream=None):
+    """Plan: relay a streamed reply, continuing it while it is cut off at max_tokens
+
+    Each follow-up stream from continue_stream(partial_text) is relayed as
+    part of the same reply, up to MAX_CONTINUATIONS times.
+    """
+    response = reply.response
+    continuations = 0
+    while True:
+        yield Relay(response, collector)
+        if collector.stopped or not collector.truncated() or continuations >= MAX_CONTINUATIONS:
+            return
+        try:
+            response = (yield from continue_stream(collector.text())).response
+        except ChatRequestError:
+            return
+        continuations += 1
+
+
+def repair_completion(api_key, completion_body, extra_headers, client, deadline, limiter=None):
+    """Plan: fix a malformed report, asking the model to rewrite only broken sections
+
+    The repair call queues behind the rate limiter and must finish before
+    deadline. Returns the repaired completion body, or the original when
+    the report is valid or could not be fully repaired.
+    """
+    plan = plan_report_repair(completion_body)
+    if plan is None:
+        return completion_body
+    completion, sections, targets = plan
+
+    repaired = []
+    if targets:
+        model = extra_headers.get('X-Model', MODEL)
+        try:
+            yield from admit_call(client, deadline, limiter)
+            reply = yield from request_model(
+                model, api_key, build_repair_messages(sections, targets), False,
+                time_left(deadline, REPORT_REPAIR_TIMEOUT), REPORT_REPAIR_MAX_TOKENS
+            )
+            sections, repaired = merge_repair(sections, targets, repair_reply(reply.body))
+        except ChatRequestError:
+            pass
+        if len(repaired) < len(targets):
+            return completion_body
+
+    extra_headers['X-Report-Repair'] = ', '.join(repaired) or 'format'
+    return finish_report_repair(completion, sections)
+
+
+def continuation_request(api_key, messages, system_prompt, model, stream, client, deadline, limiter=None):
+    """Plan factory asking the model to continue a partial reply
+
+    Each continuation queues behind the rate limiter and must finish
+    before deadline.
+    """
+    api_messages = build_api_messages(messages, system_prompt)
+
+    def continue_reply(partial):
+        yield from admit_call(client, deadline, limiter)
+        return (yield from request_model(
+            model, api_key, continuation_messages(api_messages, partial), stream, time_left(deadline)
+        ))
+
+    return continue_reply
+
+
+def complete_report(api_key, messages, extra_headers, system_prompt, client, limiter=None):
+    """Plan: generate a non-streamed report, continuing and repairing it as needed
+
+    The first call, continuations and repair share one REQUEST_TIMEOUT
+    budget, and follow-up calls queue behind limiter. Returns the final
+    completion body; raises ChatRequestError when the upstream fails.
+    """
+    deadline = time.monotonic() + REQUEST_TIMEOUT
+    reply = yield from call_upstream(api_key, messages, False, extra_headers, system_prompt, deadline)
+    completion_body = reply.body
+    if not completion_body.lstrip().startswith(b'{'):
+        raise ChatRequestError(502, 'Invalid response from AI service')
+
+    model = extra_headers.get('X-Model', MODEL)
+    completion_body = yield from continue_completion(
+        completion_body,
+        continuation_request(api_key, messages, system_prompt, model, False, client, deadline, limiter),
+        extra_headers
+    )
+    usage = record_usage(completion_body)
+    extra_headers['X-Prompt-Tokens'] = str(usage['prompt_tokens'])
+    extra_headers['X-Cached-Tokens'] = str(usage['cached_tokens'])
+    if REPORT_REPAIR:
+        completion_body = yield from repair_completion(api_key, completion_body, extra_headers, client, deadline, limiter)
+    return completion_body
+
+
+# Response headers copied into the request log line
+LOG_HEADER_FIELDS = (
+    ('model', 'X-Model'),
+    ('cache', 'X-Cache'),
+    ('prompt_variant', 'X-Prompt-Variant'),
+    ('upstream_attempts', 'X-Upstream-Attempts'),
+    ('continuations', 'X-Continuations'),
+    ('report_repair', 'X-Report-Repair')
+)
+
+
+def record_request_metrics(timing, extra_headers):
+    """Feed a finished request's timings and sizes into the metrics"""
+    fields = timing.fields
+    requests_total.inc(status=fields.get('status', 'none'))
+    request_seconds.observe(timing.elapsed())
+    if 'upstream' in timing.phases:
+        upstream_seconds.observe(timing.phases['upstream'])
+    if 'ttft' in timing.marks:
+        ttft_seconds.observe(timing.marks['ttft'])
+    request_bytes.observe(fields.get('request_bytes', 0))
+    response_bytes.observe(fields.get('response_bytes', 0))
+
+    if 'X-Cache' in extra_headers:
+        cache_lookups.inc(result=extra_headers['X-Cache'].lower())
+        hits, misses = cache_lookups.value(result='hit'), cache_lookups.value(result='miss')
+        cache_hit_ratio.set(round(hits / (hits + misses), 4))
+
+
+def finish_request(timing, extra_headers):
+    """Record metrics and write one structured log line for a finished request"""
+    if METRICS:
+        record_request_metrics(timing, extra_headers)
+    if REQUEST_LOG:
+        timing.note(**{name: extra_headers[header] for name, header in LOG_HEADER_FIELDS if header in extra_headers})
+        write_log(timing.log_record())
+
+
+def trace_response(root, timing):
+    """Describe the finished request on its root span"""
+    status = timing.fields.get('status')
+    root.set(**{
+        'http.request.method': timing.fields.get('method'),
+        'url.path': timing.fields.get('path'),
+        'http.response.status_code': status,
+        'http.response.body.size': timing.fields.get('response_bytes'),
+        'gen_ai.usage.input_tokens': timing.fields.get('prompt_tokens'),
+        'gen_ai.usage.output_tokens': timing.fields.get('completion_tokens')
+    })
+    if status is None or status >= 500:
+        root.fail(f'HTTP {status}')
+
+
+def wants_stream(body, accept_header):
+    """Check whether the client opted into Server-Sent Events streaming"""
+    if body.get('stream') is True:
+        return True
+    return STREAM_CONTENT_TYPE in (accept_header or '')
+
+
 class handler(BaseHTTPRequestHandler):
     """HTTP request handler for the chat API endpoint"""
 
-    def send_cors_headers(self):
+    def send_cors_headers(self, content_type='application/json'):
         """Add CORS headers to the response"""
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.send_header('Content-Type', 'application/json')
+        for name, value in CORS_HEADERS:
+            self.send_header(name, value)
+        self.send_header('Content-Type', content_type)
+        self.send_extra_headers()
+
+    def send_extra_headers(self):
+        """Add per-request headers collected while handling the request"""
+        for name, value in getattr(self, 'extra_headers', {}).items():
+            self.send_header(name, value)
+        timing = getattr(self, 'timing', None)
+        if SERVER_TIMING and timing is not None:
+            self.send_header('Server-Timing', timing.header())
+
+    def send_response(self, code, message=None):
+        timing = getattr(self, 'timing', None)
+        if timing is not None:
+            timing.note(status=code)
+        super().send_response(code, message)
+
+    def write_body(self, data):
+        """Write response body bytes, counting them for the request log"""
+        self.wfile.write(data)
+        timing = getattr(self, 'timing', None)
+        if timing is not None:
+            timing.note(response_bytes=timing.fields.get('response_bytes', 0) + len(data))
+            if data.startswith(b'data: '):
+                timing.mark('ttft')
+
+    def send_metrics(self):
+        """Serve the process metrics in the Prometheus text format"""
+        if not METRICS:
+            self.send_error_response(404, 'Metrics are disabled')
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
     def send_json_response(self, status_code, data):
         """Send a JSON response with proper headers"""
+        self.send_raw_json(status_code, json.dumps(data).encode('utf-8'))
+
+    def send_raw_json(self, status_code, body):
+        """Send an already-encoded JSON body without re-serializing it"""
         self.send_response(status_code)
         self.send_cors_headers()
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        self.write_body(body)
+
+    def send_completion(self, completion_body, slim):
+        """Relay a completion body verbatim, or only its text and usage"""
+        if slim:
+            self.send_json_response(200, slim_completion(completion_body))
+        else:
+            self.send_raw_json(200, completion_body)
 
     def send_error_response(self, status_code, message):
         """Send an error response"""
         self.send_json_response(status_code, {'error': message})
 
+    def relay_stream(self, reply, continue_stream=None):
+        """Forward upstream SSE lines to the client as they arrive
+
+        When the reply is cut off at max_tokens, continue_stream(partial_text)
+        plans a follow-up stream, up to MAX_CONTINUATIONS times, and its
+        deltas are relayed as part of the same reply. Returns the
+        completion body assembled from the streamed deltas, or None if the
+        stream did not finish cleanly.
+        """
+        import requests
+
+        collector = StreamCollector(
+            ReportStreamGuard() if REPORT_STREAM_CUTOFF else None,
+            continuable=continue_stream is not None and MAX_CONTINUATIONS > 0
+        )
+
+        self.send_response(200)
+        self.send_cors_headers(STREAM_CONTENT_TYPE)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+
+        try:
+            run_plan(relay_report(reply, collector, continue_stream), self.relay_lines)
+            if collector.done_withheld:
+                self.write_body(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except requests.exceptions.RequestException as e:
+            # Headers are already sent, so report the failure as an SSE event
+            error_event = {'error': {'message': f'AI service stream interrupted: {str(e)}'}}
+            self.write_body(f'data: {json.dumps(error_event)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+            return None
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away; closing the upstream response stops generation
+            return None
+
+        return collector.result()
+
+    def relay_lines(self, op):
+        """Perform a Relay step for relay_stream"""
+        try:
+            # chunk_size=None yields data as soon as the upstream flushes it
+            for line in op.response.iter_lines(chunk_size=None):
+                if not line:
+                    self.write_body(b'\n')
+                    self.wfile.flush()
+                    continue
+                for forward in op.collector.feed(line):
+                    self.write_body(forward + b'\n')
+                if op.collector.stopped:
+                    # Report is complete; closing the response stops generation
+                    break
+        finally:
+            op.response.close()
+
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
         self.send_cors_headers()
         self.end_headers()
 
+    def do_GET(self):
+        """Report service health, upstream connection reuse and model stats"""
+        self.send_json_response(200, {
+            'status': 'ok',
+            'upstream_pool': get_upstream_pool_stats(),
+            'models': model_router.snapshot(),
+            'hedges': dict(hedge_stats),
+            'tokens': get_token_stats(),
+            'coalescing': single_flight.in_flight()
+        })
+
+    def generate_completion(self, api_key, messages, stream, slim, system_prompt, client):
+        """Call the model and send its reply to the client
+
+        Returns the completion body, or None after an error response has
+        been sent or the stream failed.
+        """
+        # Make request to OpenRouter API
+        try:
+            with self.timing.phase('upstream'), trace_span('upstream', stream=stream):
+                if stream:
+                    deadline = time.monotonic() + REQUEST_TIMEOUT
+                    reply = run_plan(call_upstream(api_key, messages, True, self.extra_headers, system_prompt, deadline))
+                else:
+                    completion_body = run_plan(
+                        complete_report(api_key, messages, self.extra_headers, system_prompt, client)
+                    )
+        except ChatRequestError as e:
+            self.timing.note(upstream_status=e.status_code)
+            self.send_error_response(e.status_code, e.message)
+            return None
+        self.timing.note(upstream_status=200)
+
+        # Stream deltas straight through to the client; usage arrives last
+        if stream:
+            model = self.extra_headers.get('X-Model', MODEL)
+            with self.timing.phase('stream'), trace_span('serialize', stream=True):
+                completion_body = self.relay_stream(
+                    reply, continuation_request(api_key, messages, system_prompt, model, True, client, deadline)
+                )
+            if completion_body is not None:
+                self.timing.note(**record_usage(completion_body))
+            return completion_body
+
+        # Return successful response without re-encoding it
+        self.timing.note(**completion_usage(completion_body))
+        try:
+            with self.timing.phase('write'), trace_span('serialize', slim=slim):
+                self.send_completion(completion_body, slim)
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+            self.send_error_response(502, 'Invalid response from AI service')
+            return None
+        return completion_body
+
     def do_POST(self):
         """Handle POST requests to the chat endpoint"""
+        self.timing = RequestTiming()
+        request_id = uuid.uuid4().hex
+        self.timing.note(request_id=request_id, method='POST', path=self.path.split('?', 1)[0])
+        self.extra_headers = {'X-Request-Id': request_id}
+        requests_in_flight.inc()
         try:
-            # Read and parse request body
+            with trace_request('POST /api/chat', self.headers.get('traceparent')) as root:
+                if root is not None:
+                    self.timing.note(trace_id=root.trace_id)
+                self.handle_chat()
+                if root is not None:
+                    trace_response(root, self.timing)
+        finally:
+            requests_in_flight.dec()
+            finish_request(self.timing, self.extra_headers)
+
+    def handle_chat(self):
+        """Handle one chat request"""
+        try:
+            # Reject oversized bodies before reading them
             content_length = int(self.headers.get('Content-Length', 0))
-            raw_body = self.rfile.read(content_length)
-            
+            self.timing.note(request_bytes=content_length)
+            if content_length > MAX_BODY_BYTES:
+                self.send_error_response(413, f'Request body exceeds {MAX_BODY_BYTES} bytes')
+                return
+
+            # Read and parse request body
             try:
-                body = json.loads(raw_body.decode('utf-8'))
+                with trace_span('parse', **{'http.request.body.size': content_length}):
+                    with self.timing.phase('read'):
+                        raw = read_body(self.rfile, content_length)
+                    with self.timing.phase('parse'):
+                        body = parse_body(raw)
             except json.JSONDecodeError:
                 self.send_error_response(400, 'Invalid JSON in request body')
                 return
+            except ValueError as e:
+                self.send_error_response(400, str(e))
+                return
 
             # Get API key from environment
             api_key = os.environ.get('OPENROUTER_API_KEY')
@@ -178,92 +1780,78 @@ class handler(BaseHTTPRequestHandler):
                 self.send_error_response(500, 'API key not configured. Please set OPENROUTER_API_KEY environment variable.')
                 return
 
-            # Get messages from request
-            messages = body.get('messages', [])
-            if not messages:
-                self.send_error_response(400, 'No messages provided in request')
-                return
-
-            # Prepend system message
-            api_messages = [
-                {
-                    'role': 'system',
-                    'content': SYSTEM_PROMPT
-                }
-            ]
-
-            # Process and add user messages
-            for msg in messages:
-                role = msg.get('role', 'user')
-                content = msg.get('content', [])
-                
-                # Handle content array format
-                if isinstance(content, list):
-                    api_messages.append({
-                        'role': role,
-                        'content': content
-                    })
-                else:
-                    # Handle simple string content
-                    api_messages.append({
-                        'role': role,
-                        'content': [{'type': 'text', 'text': str(content)}]
-                    })
-
-            # Get site URL for OpenRouter headers
-            site_url = os.environ.get('SITE_URL', 'https://form-builder-bug-report.vercel.app')
-
-            # Prepare OpenRouter API request
-            headers = {
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json',
-                'HTTP-Referer': site_url,
-                'X-Title': 'Form Builder Bug Report'
-            }
-
-            payload = {
-                'model': MODEL,
-                'messages': api_messages,
-                'max_tokens': MAX_TOKENS,
-                'temperature': TEMPERATURE
-            }
-
-            # Make request to OpenRouter API
+            # Get messages from request, either in full or as a single new turn
             try:
-                response = requests.post(
-                    OPENROUTER_API_URL,
-                    headers=headers,
-                    json=payload,
-                    timeout=REQUEST_TIMEOUT
-                )
-            except requests.exceptions.Timeout:
-                self.send_error_response(504, 'Request to AI service timed out')
-                return
-            except requests.exceptions.RequestException as e:
-                self.send_error_response(502, f'Failed to connect to AI service: {str(e)}')
+                with trace_span('build-messages') as build, self.timing.phase('prepare'):
+                    messages, conversation_id = resolve_messages(body, self.extra_headers)
+                    variant = choose_prompt_variant(body.get('prompt_variant'), conversation_id)
+                    images = sum(content_parts(msg)[1] for msg in messages)
+                    if build is not None:
+                        build.set(messages=len(messages), images=images, prompt_variant=variant)
+            except ChatRequestError as e:
+                self.send_error_response(e.status_code, e.message)
                 return
+            system_prompt = PROMPT_VARIANTS[variant]
+            self.extra_headers['X-Prompt-Variant'] = variant
+            self.timing.note(images=images)
 
-            # Handle API response
-            if response.status_code != 200:
-                error_detail = 'Unknown error'
-                try:
-                    error_data = response.json()
-                    error_detail = error_data.get('error', {}).get('message', str(error_data))
-                except:
-                    error_detail = response.text[:200] if response.text else 'No error details'
-                
-                self.send_error_response(
-                    response.status_code,
-                    f'AI service error: {error_detail}'
-                )
+            # Slim responses carry only the report text and token usage
+            slim = body.get('slim') is True
+
+            # Serve identical prompts from the response cache
+            with self.timing.phase('cache'):
+                key = response_cache_key(system_prompt, messages)
+                cached = cache_lookup(key)
+            if response_cache is not None:
+                self.extra_headers['X-Cache'] = 'HIT' if cached is not None else 'MISS'
+            if cached is not None:
+                self.send_completion(cached, slim)
+                save_conversation(conversation_id, messages, cached)
                 return
 
-            # Return successful response
+            # Share an identical in-flight request instead of calling the model again
+            leader = True
+            if SINGLE_FLIGHT:
+                flight, leader = single_flight.join(key)
+                if not leader:
+                    with self.timing.phase('coalesce'):
+                        completion_body = wait_for_leader(flight)
+                    if completion_body is not None:
+                        self.extra_headers['X-Coalesced'] = '1'
+                        self.timing.note(coalesced=True)
+                        self.send_completion(completion_body, slim)
+                        save_conversation(conversation_id, messages, completion_body)
+                        return
+
+            completion_body = None
             try:
-                response_data = response.json()
-                self.send_json_response(200, response_data)
-            except json.JSONDecodeError:
-                self.send_error_response(502, 'Invalid response from AI service')
+                # Queue behind the rate limiter, or reject outright when the queue is full
+                client = client_id(self.headers, self.client_address[0])
+                try:
+                    delay = rate_limiter.admit(client)
+                except RateLimited as e:
+                    self.extra_headers['Retry-After'] = str(e.retry_after)
+                    self.send_error_response(429, 'Too many requests. Please retry shortly.')
+                    return
+                if delay:
+                    try:
+                        with self.timing.phase('queue'):
+                            time.sleep(delay)
+                    finally:
+                        rate_limiter.release()
+
+                stream = wants_stream(body, self.headers.get('Accept'))
+                self.timing.note(stream=stream)
+                completion_body = self.generate_completion(api_key, messages, stream, slim, system_prompt, client)
+                if completion_body is not None:
+                    cache_store(key, completion_body)
+            finally:
+                # Cache first so no request slips between the flight ending and the store
+                if SINGLE_FLIGHT and leader:
+                    single_flight.finish(key, completion_body)
+
+            if completion_body is not None:
+                save_conversation(conversation_id, messages, completion_body)
 
         except Exception as e:
             # Catch-all error handler
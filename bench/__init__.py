@@ -0,0 +1,4 @@
+"""
+Form Builder Bug Report - Benchmarks
+Load and cold start harnesses for /api/chat against a local mock of the OpenRouter API
+"""
@@ -0,0 +1,318 @@
+"""
+Form Builder Bug Report - Load Benchmark
+Drives /api/chat with text and screenshot payloads against a mock upstream
+and reports throughput, latency percentiles, TTFB and peak RSS
+
+Run with: python -m bench --requests 200 --concurrency 16 --payload mixed
+"""
+
+import argparse
+import base64
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import requests
+
+from api._routing import percentile
+from bench.upstream import UpstreamProfile, parse_distribution, start_upstream
+
+DESCRIPTIONS = [
+    'When I submit the leave request form with an empty start date nothing happens and no error is shown.',
+    'The Print Out template cuts off the last column of the order table when the page is landscape.',
+    'In View App the dropdown for Department shows duplicate options after switching tabs twice.',
+    'Statistics report shows 0 for the monthly total even though the chart shows the right values.',
+    'Dragging a field into a section in Form Builder drops it at the top instead of where I released it.'
+]
+
+# Metrics compared against a baseline run, and whether higher is better
+COMPARED_METRICS = [
+    ('throughput_rps', True),
+    ('latency_ms.p50', False),
+    ('latency_ms.p95', False),
+    ('latency_ms.p99', False),
+    ('ttfb_ms.p50', False),
+    ('ttfb_ms.p95', False),
+    ('peak_rss_mb', False)
+]
+
+
+def make_screenshot(width=1440, height=900, seed=0):
+    """A synthetic Form Builder screenshot as a PNG data URI"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), (245, 246, 248))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 56), fill=(33, 37, 41))
+    draw.rectangle((0, 56, 240, height), fill=(255, 255, 255))
+    for i in range(16):
+        draw.text((20, 80 + i * 36), f'Menu item {i + 1}', fill=(60, 60, 60))
+
+    y = 90
+    for i in range(10):
+        draw.text((280, y), f'Field label {i + 1}', fill=(30, 30, 30))
+        draw.rectangle((280, y + 18, width - 80, y + 50), outline=(200, 200, 200), fill=(255, 255, 255))
+        draw.text((290, y + 28), ''.join(rng.choice('abcdefghij ') for _ in range(60)), fill=(90, 90, 90))
+        y += 78
+
+    # Light noise keeps the PNG from compressing far better than a real capture
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.04)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def build_payload(kind, index, stream, screenshot=None):
+    """Request body for one benchmark request
+
+    Each description is made unique so the response cache and request
+    coalescing do not short-circuit the upstream call.
+    """
+    if kind == 'mixed':
+        kind = 'screenshot' if index % 2 else 'text'
+    description = f'{DESCRIPTIONS[index % len(DESCRIPTIONS)]} (run {index})'
+    content = description
+    if kind == 'screenshot':
+        content = [
+            {'type': 'text', 'text': description},
+            {'type': 'image_url', 'image_url': {'url': screenshot}}
+        ]
+    return json.dumps({'messages': [{'role': 'user', 'content': content}], 'stream': stream}).encode('utf-8')
+
+
+def send_request(session, url, body, started, timeout):
+    """POST one payload and time it from started
+
+    TTFB is the time to the first response body byte; for streams that is
+    the first relayed delta rather than the headers.
+    """
+    try:
+        response = session.post(url, data=body, headers={'Content-Type': 'application/json'},
+                                stream=True, timeout=timeout)
+        try:
+            first = response.raw.read(1)
+            ttfb = time.monotonic() - started
+            size = len(first) + len(response.raw.read())
+        finally:
+            response.close()
+    except requests.exceptions.RequestException as e:
+        return {'status': 'error', 'latency': time.monotonic() - started, 'ttfb': None, 'bytes': 0, 'error': str(e)}
+    return {'status': response.status_code, 'latency': time.monotonic() - started, 'ttfb': ttfb, 'bytes': size}
+
+
+def run_load(url, make_body, total, concurrency, qps=0, timeout=120):
+    """Send total requests and return (samples, wall seconds)
+
+    Without qps, concurrency workers send back to back (closed loop). With
+    qps, requests are released on a fixed schedule and timed from their
+    scheduled start, so time spent waiting for a free worker counts too.
+    """
+    local = threading.local()
+
+    def task(index, scheduled):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        body = make_body(index)
+        return send_request(local.session, url, body, scheduled or time.monotonic(), timeout)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as executor:
+        futures = []
+        for index in range(total):
+            scheduled = None
+            if qps:
+                scheduled = started + index / qps
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(task, index, scheduled))
+        samples = [future.result() for future in futures]
+    return samples, time.monotonic() - started
+
+
+def distribution(values):
+    """Mean and tail percentiles in milliseconds"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values) * 1000, 1),
+        'p50': round(percentile(values, 0.50) * 1000, 1),
+        'p95': round(percentile(values, 0.95) * 1000, 1),
+        'p99': round(percentile(values, 0.99) * 1000, 1),
+        'max': round(values[-1] * 1000, 1)
+    }
+
+
+def peak_rss_mb(pid=None):
+    """Peak resident memory of pid, or of this process when pid is None"""
+    if pid:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+        return None
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(usage / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def summarize(samples, wall):
+    ok = [s for s in samples if s['status'] == 200]
+    return {
+        'requests': len(samples),
+        'ok': len(ok),
+        'statuses': dict(Counter(str(s['status']) for s in samples)),
+        'wall_seconds': round(wall, 2),
+        'throughput_rps': round(len(ok) / wall, 2) if wall else 0.0,
+        'latency_ms': distribution(s['latency'] for s in ok),
+        'ttfb_ms': distribution(s['ttfb'] for s in ok),
+        'response_bytes': sum(s['bytes'] for s in ok)
+    }
+
+
+def metric(summary, path):
+    value = summary
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def print_summary(summary):
+    print(f'requests   {summary["requests"]} ({summary["ok"]} ok) in {summary["wall_seconds"]}s, '
+          f'statuses {summary["statuses"]}')
+    print(f'throughput {summary["throughput_rps"]} req/s')
+    for name in ('latency_ms', 'ttfb_ms'):
+        row = summary[name]
+        if row:
+            print(f'{name[:-3]:<10} p50 {row["p50"]} ms  p95 {row["p95"]} ms  p99 {row["p99"]} ms  max {row["max"]} ms')
+    print(f'peak RSS   {summary["peak_rss_mb"]} MB')
+    if summary.get('upstream'):
+        print(f'upstream   {summary["upstream"]}')
+
+
+def print_comparison(summary, baseline):
+    """Print each compared metric next to the baseline run"""
+    print(f'\n{"metric":<16} {"baseline":>10} {"current":>10} {"change":>9}')
+    for path, higher_is_better in COMPARED_METRICS:
+        before, after = metric(baseline, path), metric(summary, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        flag = '' if abs(change) < 5 else (' better' if better else ' WORSE')
+        print(f'{path:<16} {before:>10} {after:>10} {change:>+8.1f}%{flag}')
+
+
+def start_server(threads):
+    """Run the threaded server from python -m server inside this process"""
+    # Imported late so the environment set up in main() is what api.chat reads
+    from server.__main__ import STATIC_DIR, PooledHTTPServer, ServerHandler
+
+    class QuietHandler(ServerHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = PooledHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=STATIC_DIR), threads, 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/api/chat'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__.strip().splitlines()[1])
+    load = parser.add_argument_group('load')
+    load.add_argument('--requests', type=int, default=100, help='requests to send')
+    load.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+    load.add_argument('--qps', type=float, default=0, help='fixed arrival rate instead of back-to-back requests')
+    load.add_argument('--payload', choices=('text', 'screenshot', 'mixed'), default='mixed')
+    load.add_argument('--stream', action='store_true', help='request Server-Sent Events streaming')
+    load.add_argument('--timeout', type=float, default=120, help='per-request client timeout in seconds')
+
+    target = parser.add_argument_group('server under test')
+    target.add_argument('--target', help='URL of an already running /api/chat (default: start one in-process)')
+    target.add_argument('--pid', type=int, help='process id of --target, for its peak RSS')
+    target.add_argument('--threads', type=int, default=32, help='threads of the in-process server')
+
+    upstream = parser.add_argument_group('mock upstream')
+    upstream.add_argument('--ttft', default='lognormal:0.4,0.5',
+                          help='time to first token: fixed:S, uniform:A,B, normal:M,SD, lognormal:MEDIAN,SIGMA or exp:MEAN')
+    upstream.add_argument('--token-rate', type=float, default=50, help='completion tokens per second (0: instant)')
+    upstream.add_argument('--completion-tokens', type=int, default=300, help='tokens in each reply')
+    upstream.add_argument('--error-rate', type=float, default=0.0, help='share of upstream calls that fail')
+    upstream.add_argument('--error-status', type=int, default=503, help='status code of injected failures')
+    upstream.add_argument('--seed', type=int, help='seed for latency and error sampling')
+    upstream.add_argument('--upstream-only', action='store_true',
+                          help='only serve the mock upstream, for use with an external server')
+    upstream.add_argument('--upstream-port', type=int, default=0)
+
+    parser.add_argument('--json', dest='json_path', help='write the configuration and results to this file')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    try:
+        parse_distribution(args.ttft)
+    except ValueError as e:
+        parser.error(str(e))
+
+    profile = UpstreamProfile(args.ttft, args.token_rate, args.completion_tokens,
+                              args.error_rate, args.error_status, args.seed)
+    url = args.target
+    if args.upstream_only or not url:
+        upstream_server, upstream_url = start_upstream(profile, port=args.upstream_port)
+    if args.upstream_only:
+        print(f'Mock upstream on {upstream_url}; set OPENROUTER_API_URL to it', flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return
+
+    if not url:
+        os.environ['OPENROUTER_API_URL'] = upstream_url
+        os.environ.setdefault('OPENROUTER_API_KEY', 'bench')
+        # Measure the request path, not admission control or cached replies
+        for name, value in (('RATE_LIMIT_GLOBAL_RPM', '0'), ('RATE_LIMIT_CLIENT_RPM', '0'),
+                            ('RESPONSE_CACHE_BACKEND', 'none'), ('REQUEST_LOG', 'off')):
+            os.environ.setdefault(name, value)
+        _, url = start_server(args.threads)
+
+    screenshot = make_screenshot() if args.payload != 'text' else None
+    samples, wall = run_load(
+        url,
+        lambda index: build_payload(args.payload, index, args.stream, screenshot),
+        args.requests,
+        args.concurrency,
+        args.qps,
+        args.timeout
+    )
+
+    summary = summarize(samples, wall)
+    if args.target:
+        # The mock and the server run elsewhere
+        summary['peak_rss_mb'] = peak_rss_mb(args.pid) if args.pid else None
+    else:
+        summary['peak_rss_mb'] = peak_rss_mb()
+        summary['upstream'] = profile.snapshot()
+    print_summary(summary)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(summary, json.load(f)['results'])
+    if args.json_path:
+        config = {name: value for name, value in vars(args).items() if name not in ('json_path', 'baseline')}
+        with open(args.json_path, 'w') as f:
+            json.dump({'config': config, 'results': summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Form Builder Bug Report - Cold Start Benchmark
+Times importing api.chat and serving its first request in fresh interpreters,
+as a Vercel cold start does, so import-time regressions show up in review
+
+Run with: python -m bench.coldstart --runs 20 --json coldstart.json
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from bench.__main__ import distribution, metric
+from bench.upstream import UpstreamProfile, start_upstream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in each fresh interpreter: import the function, then serve one request
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from api import chat
+imported = time.perf_counter()
+eager = [name for name in sys.argv[1:] if name in sys.modules]
+
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+import threading
+chat.handler.log_message = lambda *args: None
+server = ThreadingHTTPServer(('127.0.0.1', 0), chat.handler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+body = json.dumps({'messages': [{'role': 'user', 'content': 'The Submit button does nothing'}]})
+requested = time.perf_counter()
+connection = HTTPConnection('127.0.0.1', server.server_port)
+connection.request('POST', '/api/chat', body, {'Content-Type': 'application/json'})
+response = connection.getresponse()
+response.read()
+finished = time.perf_counter()
+print(json.dumps({
+    'status': response.status,
+    'import': imported - started,
+    'first_request': finished - requested,
+    'eager_modules': eager
+}))
+'''
+
+# Modules api.chat should only load when a request needs them
+DEFERRED_MODULES = ['requests', 'urllib3', 'PIL']
+
+# Metrics compared against a baseline run; lower is better for all of them
+COMPARED_METRICS = ['import_ms.p50', 'first_request_ms.p50', 'process_ms.p50']
+
+IMPORTTIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def probe_env(upstream_url):
+    """Environment for the probe: mock upstream, nothing cached or persisted"""
+    env = dict(os.environ)
+    env.update({
+        'OPENROUTER_API_URL': upstream_url,
+        'OPENROUTER_API_KEY': env.get('OPENROUTER_API_KEY', 'bench'),
+        'RESPONSE_CACHE_BACKEND': 'none',
+        'CONVERSATION_BACKEND': 'none',
+        'REQUEST_LOG': 'off',
+        'PYTHONPATH': ROOT
+    })
+    return env
+
+
+def run_probe(env):
+    """Start one interpreter and return its timings in seconds"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE] + DEFERRED_MODULES,
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f'Cold start probe failed:\n{result.stderr.strip()}')
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['process'] = elapsed
+    return sample
+
+
+def slowest_imports(env, count):
+    """Modules imported by api.chat with the most cumulative import time"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'from api import chat'],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    # Lines come children first; keep the direct imports listed before api.chat
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        ms, depth, name = int(match.group(2)) / 1000, len(match.group(3)), match.group(4)
+        if name == 'api.chat':
+            rows.append((ms, name))
+            break
+        if depth == 1:
+            rows = []
+        elif depth == 3:
+            rows.append((ms, name))
+    return [{'module': name, 'ms': round(ms, 1)} for ms, name in sorted(rows, reverse=True)[:count]]
+
+
+def summarize(samples):
+    ok = [s for s in samples if s['status'] == 200]
+    eager = sorted({name for s in samples for name in s['eager_modules']})
+    return {
+        'runs': len(samples),
+        'ok': len(ok),
+        'import_ms': distribution(s['import'] for s in samples),
+        'first_request_ms': distribution(s['first_request'] for s in ok),
+        'process_ms': distribution(s['process'] for s in samples),
+        'eager_modules': eager
+    }
+
+
+def print_summary(summary, imports):
+    print(f'runs          {summary["runs"]} ({summary["ok"]} first requests ok)')
+    for name in ('import_ms', 'first_request_ms', 'process_ms'):
+        row = summary[name]
+        if row:
+            print(f'{name[:-3]:<13} p50 {row["p50"]} ms  p95 {row["p95"]} ms  max {row["max"]} ms')
+    print(f'eager modules {", ".join(summary["eager_modules"]) or "none"}')
+    if imports:
+        print('\nslowest imports (cumulative)')
+        for row in imports:
+            print(f'  {row["ms"]:>8} ms  {row["module"]}')
+
+
+def print_comparison(summary, baseline):
+    """Print each compared metric next to the baseline run"""
+    print(f'\n{"metric":<22} {"baseline":>10} {"current":>10} {"change":>9}')
+    for path in COMPARED_METRICS:
+        before, after = metric(baseline, path), metric(summary, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        flag = '' if abs(change) < 5 else (' better' if change < 0 else ' WORSE')
+        print(f'{path:<22} {before:>10} {after:>10} {change:>+8.1f}%{flag}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.coldstart', description=__doc__.strip().splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters to start')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list (0: none)')
+    parser.add_argument('--max-import-ms', type=float,
+                        help='exit with status 1 when the median import time is above this')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    _, upstream_url = start_upstream(UpstreamProfile('fixed:0', 0, 300, 0.0, 503, 0))
+    env = probe_env(upstream_url)
+
+    # Untimed run so every probe reads the same bytecode cache
+    run_probe(env)
+    summary = summarize([run_probe(env) for _ in range(args.runs)])
+    imports = slowest_imports(env, args.top) if args.top else []
+    print_summary(summary, imports)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(summary, json.load(f)['results'])
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'config': {'runs': args.runs, 'python': sys.version.split()[0]},
+                       'results': summary, 'imports': imports}, f, indent=2)
+    if args.max_import_ms is not None and summary['import_ms']['p50'] > args.max_import_ms:
+        print(f'\nMedian import time is above {args.max_import_ms} ms', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Form Builder Bug Report - Mock Upstream
+Local stand-in for the OpenRouter chat completions API with configurable
+time to first token, token rate and injected errors
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+from api._report import SEPARATOR
+
+CHARS_PER_TOKEN = 4
+STREAM_TOKENS_PER_CHUNK = 5
+
+
+def parse_distribution(spec):
+    """Turn a spec such as "lognormal:0.4,0.5" into a sampler of seconds
+
+    Supported: fixed:S, uniform:LOW,HIGH, normal:MEAN,SD, lognormal:MEDIAN,SIGMA
+    and exp:MEAN. Samples are never negative.
+    """
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(v) for v in args.split(',')] if args else []
+    except ValueError:
+        raise ValueError(f'Invalid distribution: {spec}')
+
+    samplers = {
+        'fixed': (1, lambda rng, s: s),
+        'uniform': (2, lambda rng, low, high: rng.uniform(low, high)),
+        'normal': (2, lambda rng, mean, sd: rng.gauss(mean, sd)),
+        'lognormal': (2, lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma)),
+        'exp': (1, lambda rng, mean: rng.expovariate(1 / mean))
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f'Invalid distribution: {spec}')
+    sample = samplers[kind][1]
+    return lambda rng: max(0.0, sample(rng, *values))
+
+
+def report_text(tokens):
+    """A well-formed bug report padded with bullets to about the given size"""
+    sections = [
+        'Summary:\nSubmitting a form with a required date field fails silently.',
+        'Title:\nForm Builder | Forms | Date Field | Submit fails when date is empty',
+        'Reproduce Steps:\n1. Open the form in View App\n2. Leave the date field empty\n3. Click Submit',
+        'Actual Result:\n* Nothing happens and no validation message is shown'
+    ]
+    expected = ['Expected Result:', '* A validation message is shown under the date field']
+    text = f'\n{SEPARATOR}\n\n'.join(sections + ['\n'.join(expected)])
+    filler = 0
+    while len(text) < tokens * CHARS_PER_TOKEN:
+        filler += 1
+        text += f'\n* The form keeps the entered values after validation fails ({filler})'
+    return text
+
+
+class UpstreamProfile:
+    """How the mock upstream behaves: timing, reply size and failures"""
+
+    def __init__(self, ttft='lognormal:0.4,0.5', token_rate=50.0, completion_tokens=300,
+                 error_rate=0.0, error_status=503, seed=None):
+        self.ttft = parse_distribution(ttft)
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'streamed': 0, 'errors_injected': 0, 'prompt_bytes': 0}
+
+    def plan(self, body_size, stream):
+        """Draw the outcome for one request: (error status or None, TTFT seconds)"""
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['streamed'] += stream
+            self.stats['prompt_bytes'] += body_size
+            if self.rng.random() < self.error_rate:
+                self.stats['errors_injected'] += 1
+                return self.error_status, 0.0
+            return None, self.ttft(self.rng)
+
+    def token_delay(self, tokens):
+        return tokens / self.token_rate if self.token_rate > 0 else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+class MockUpstream(BaseHTTPRequestHandler):
+    """Answers chat completion requests according to server.profile"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        payload = json.loads(raw)
+        stream = payload.get('stream') is True
+        profile = self.server.profile
+
+        error_status, ttft = profile.plan(len(raw), stream)
+        if error_status:
+            self.send_error_reply(error_status)
+            return
+        time.sleep(ttft)
+
+        tokens = profile.completion_tokens
+        content = report_text(tokens)
+        finish_reason = 'stop'
+        if payload.get('max_tokens') and tokens > payload['max_tokens']:
+            # Cut off at the budget like a real model, which triggers continuation
+            tokens, finish_reason = payload['max_tokens'], 'length'
+            content = content[:tokens * CHARS_PER_TOKEN]
+        usage = {'prompt_tokens': math.ceil(len(raw) / CHARS_PER_TOKEN), 'completion_tokens': tokens}
+
+        if stream:
+            self.send_stream(content, finish_reason, usage)
+            return
+
+        time.sleep(profile.token_delay(tokens))
+        body = json.dumps({
+            'choices': [{'message': {'role': 'assistant', 'content': content}, 'finish_reason': finish_reason}],
+            'usage': usage
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_reply(self, status):
+        body = json.dumps({'error': {'message': f'Injected error {status}'}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def send_stream(self, content, finish_reason, usage):
+        """Send SSE deltas paced by the profile's token rate"""
+        profile = self.server.profile
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            self.send_chunk(b': OPENROUTER PROCESSING\n\n')
+            step = STREAM_TOKENS_PER_CHUNK * CHARS_PER_TOKEN
+            for start in range(0, len(content), step):
+                event = {'choices': [{'index': 0, 'delta': {'content': content[start:start + step]}}]}
+                self.send_chunk(b'data: ' + json.dumps(event).encode('utf-8') + b'\n\n')
+                time.sleep(profile.token_delay(STREAM_TOKENS_PER_CHUNK))
+            final = {'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}], 'usage': usage}
+            self.send_chunk(b'data: ' + json.dumps(final).encode('utf-8') + b'\n\n')
+            self.send_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The server closed the stream early, as it does once a report is complete
+            self.close_connection = True
+
+
+class MockUpstreamServer(ThreadingHTTPServer):
+    """Threaded server for MockUpstream that stays quiet when clients drop connections"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The server under test resets pooled keep-alive connections when it discards them
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_upstream(profile, host='127.0.0.1', port=0):
+    """Serve the mock on a background thread; returns (server, completions URL)"""
+    server = MockUpstreamServer((host, port), MockUpstream)
+    server.profile = profile
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_port}/api/v1/chat/completions'
@@ -0,0 +1,4 @@
+"""
+Form Builder Bug Report - Prompt Evaluation
+Offline harness comparing system prompt variants on a fixture set
+"""
@@ -0,0 +1,215 @@
+"""
+Form Builder Bug Report - Prompt Evaluation
+Runs the fixture bug descriptions through each system prompt variant and
+reports prompt tokens, latency and report format compliance
+
+Run with: python -m evals --variants full,compact
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+
+from api import chat
+from api._report import SEPARATOR, validate_report
+from api._routing import percentile
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures.json')
+
+
+def stub_report(description):
+    """A well-formed report built from the description, as the stub's reply"""
+    sentence = description.strip().split('. ')[0].rstrip('.')
+    return '\n'.join([
+        'Summary:',
+        f'{sentence}.',
+        SEPARATOR,
+        '',
+        'Title:',
+        f'Form Builder | App | Form | {sentence[:60]}',
+        SEPARATOR,
+        '',
+        'Reproduce Steps:',
+        '1. Open the affected form',
+        '2. Perform the action described in the report',
+        SEPARATOR,
+        '',
+        'Actual Result:',
+        f'* {sentence}',
+        SEPARATOR,
+        '',
+        'Expected Result:',
+        '* The form behaves as configured'
+    ])
+
+
+class StubUpstream(BaseHTTPRequestHandler):
+    """OpenRouter stand-in whose latency grows with the prompt size
+
+    Replies with a compliant report, so it measures prompt tokens and the
+    request pipeline rather than model quality.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    base_latency = 0.05
+    seconds_per_1k_tokens = 0.02
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = json.dumps(payload['messages'])
+        prompt_tokens = chat.estimate_tokens(prompt)
+        time.sleep(self.base_latency + prompt_tokens / 1000 * self.seconds_per_1k_tokens)
+
+        description = payload['messages'][-1]['content'][0]['text']
+        content = stub_report(description)
+        body = json.dumps({
+            'choices': [{'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': chat.estimate_tokens(content)}
+        }).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/api/v1/chat/completions'
+
+
+def call_model(url, api_key, model, system_prompt, description):
+    """Send one fixture upstream and return (content, usage, latency)"""
+    messages = [{'role': 'user', 'content': description}]
+    api_messages = chat.build_api_messages(messages, system_prompt)
+    headers, payload = chat.build_upstream_request(api_key, api_messages, False, model)
+
+    started = time.monotonic()
+    response = chat.get_upstream_session().post(url, headers=headers, json=payload, timeout=chat.REQUEST_TIMEOUT)
+    latency = time.monotonic() - started
+    response.raise_for_status()
+
+    completion = response.json()
+    return completion['choices'][0]['message']['content'], completion.get('usage') or {}, latency
+
+
+def evaluate(variants, fixtures, call):
+    """Run every fixture through every variant
+
+    call(variant, fixture) returns (content, usage, latency). Returns a
+    summary per variant plus the individual results.
+    """
+    summary = {}
+    results = []
+    for variant in variants:
+        system_prompt = chat.PROMPT_VARIANTS[variant]
+        latencies = []
+        prompt_tokens = []
+        compliant = 0
+
+        for fixture in fixtures:
+            content, usage, latency = call(variant, fixture)
+            problems = validate_report(content)
+            tokens = usage.get('prompt_tokens') or chat.estimate_tokens(system_prompt + fixture['description'])
+
+            latencies.append(latency)
+            prompt_tokens.append(tokens)
+            compliant += not problems
+            results.append({
+                'variant': variant,
+                'fixture': fixture['id'],
+                'prompt_tokens': tokens,
+                'completion_tokens': usage.get('completion_tokens'),
+                'latency_ms': round(latency * 1000, 1),
+                'problems': [f'{section or "Report"} {problem}' for section, problem in problems],
+                'content': content
+            })
+
+        latencies.sort()
+        summary[variant] = {
+            'system_prompt_tokens': chat.estimate_tokens(system_prompt),
+            'mean_prompt_tokens': round(sum(prompt_tokens) / len(prompt_tokens), 1),
+            'p50_latency_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_latency_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'compliance': round(compliant / len(fixtures), 3)
+        }
+    return summary, results
+
+
+def print_summary(summary, results):
+    print(f'{"variant":<10} {"sys tok":>8} {"prompt tok":>11} {"p50 ms":>9} {"p95 ms":>9} {"compliant":>10}')
+    for variant, row in summary.items():
+        print(f'{variant:<10} {row["system_prompt_tokens"]:>8} {row["mean_prompt_tokens"]:>11} '
+              f'{row["p50_latency_ms"]:>9} {row["p95_latency_ms"]:>9} {row["compliance"]:>10.1%}')
+    for result in results:
+        for problem in result['problems']:
+            print(f'  {result["variant"]}/{result["fixture"]}: {problem}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m evals', description=__doc__.strip().splitlines()[1])
+    parser.add_argument('--variants', default=','.join(chat.PROMPT_VARIANTS),
+                        help='comma-separated prompt variants to compare')
+    parser.add_argument('--fixtures', default=FIXTURES_PATH, help='JSON list of {id, description}')
+    parser.add_argument('--mode', choices=('stub', 'live', 'replay'), default='stub',
+                        help='stub: local fake upstream; live: OpenRouter; replay: recorded responses')
+    parser.add_argument('--model', default=chat.MODEL, help='model for live runs')
+    parser.add_argument('--recordings', help='recorded responses to replay, or where to save them')
+    parser.add_argument('--json', dest='json_path', help='write the summary and results to this file')
+    args = parser.parse_args(argv)
+
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    unknown = [v for v in variants if v not in chat.PROMPT_VARIANTS]
+    if unknown:
+        parser.error(f'unknown variants: {", ".join(unknown)}')
+    with open(args.fixtures) as f:
+        fixtures = json.load(f)
+
+    recordings = {}
+    if args.mode == 'replay':
+        if not args.recordings:
+            parser.error('--mode replay requires --recordings')
+        with open(args.recordings) as f:
+            recordings = json.load(f)
+
+        def call(variant, fixture):
+            recorded = recordings[f'{variant}/{fixture["id"]}']
+            return recorded['content'], recorded['usage'], recorded['latency']
+    else:
+        if args.mode == 'stub':
+            _, url = start_stub()
+            api_key = 'stub'
+        else:
+            url = chat.OPENROUTER_API_URL
+            api_key = os.environ.get('OPENROUTER_API_KEY')
+            if not api_key:
+                parser.error('--mode live requires OPENROUTER_API_KEY')
+
+        def call(variant, fixture):
+            content, usage, latency = call_model(
+                url, api_key, args.model, chat.PROMPT_VARIANTS[variant], fixture['description']
+            )
+            recordings[f'{variant}/{fixture["id"]}'] = {'content': content, 'usage': usage, 'latency': latency}
+            return content, usage, latency
+
+    summary, results = evaluate(variants, fixtures, call)
+    print_summary(summary, results)
+
+    if args.recordings and args.mode != 'replay':
+        with open(args.recordings, 'w') as f:
+            json.dump(recordings, f, indent=2)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'summary': summary, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
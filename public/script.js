@@ -21,6 +21,7 @@ const dropZoneOverlay = document.getElementById('dropZoneOverlay');
 let currentImage = null; // { base64: string, mimeType: string }
 let isLoading = false;
 let messageHistory = []; // Array of { role: string, content: array }
+let conversationId = null; // Server-side conversation session, once established
 
 // ==================== Theme Management ====================
 
@@ -366,10 +367,11 @@ async function sendMessage(text, image) {
     scrollToBottom();
 
     // Add to message history
-    messageHistory.push({
+    const userTurn = {
         role: 'user',
         content: content
-    });
+    };
+    messageHistory.push(userTurn);
 
     // Clear input and image
     messageInput.value = '';
@@ -382,41 +384,45 @@ async function sendMessage(text, image) {
     showTypingIndicator();
 
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                messages: messageHistory
-            })
-        });
-
-        removeTypingIndicator();
+        const response = await postChatTurn(userTurn);
 
         if (!response.ok) {
+            removeTypingIndicator();
             const errorData = await response.json().catch(() => ({}));
             throw new Error(errorData.error || `Request failed with status ${response.status}`);
         }
 
-        const data = await response.json();
-        
-        // Extract assistant message
-        const assistantContent = data.choices?.[0]?.message?.content || 'No response received.';
-        
+        let assistantContent;
+        const contentType = response.headers.get('Content-Type') || '';
+
+        if (contentType.includes('text/event-stream')) {
+            assistantContent = await renderStreamedResponse(response);
+        } else {
+            removeTypingIndicator();
+
+            const data = await response.json();
+
+            // Extract assistant message
+            assistantContent = data.content || data.choices?.[0]?.message?.content || 'No response received.';
+
+            // Display assistant message
+            const assistantMessage = createMessageElement('assistant', assistantContent);
+            messagesArea.appendChild(assistantMessage);
+            scrollToBottom();
+        }
+
         // Add to message history
         messageHistory.push({
             role: 'assistant',
             content: [{ type: 'text', text: assistantContent }]
         });
 
-        // Display assistant message
-        const assistantMessage = createMessageElement('assistant', assistantContent);
-        messagesArea.appendChild(assistantMessage);
-        scrollToBottom();
-
     } catch (error) {
         removeTypingIndicator();
+        // The server did not store the failed turn, so keep it out of the history too
+        if (messageHistory[messageHistory.length - 1] === userTurn) {
+            messageHistory.pop();
+        }
         console.error('API Error:', error);
         showErrorMessage(`Failed to send message: ${error.message}`);
     } finally {
@@ -426,6 +432,138 @@ async function sendMessage(text, image) {
     }
 }
 
+/**
+ * Create a W3C traceparent header so server traces can be tied to this turn
+ * @returns {string} traceparent value with fresh trace and span ids
+ */
+function createTraceparent() {
+    const hex = (bytes) => Array.from(crypto.getRandomValues(new Uint8Array(bytes)),
+        (b) => b.toString(16).padStart(2, '0')).join('');
+    return `00-${hex(16)}-${hex(8)}-01`;
+}
+
+/**
+ * Post a chat turn, sending only the new message once a session exists
+ * @param {object} message - The newest user message
+ * @returns {Promise<Response>} Fetch response
+ */
+async function postChatTurn(message) {
+    const post = (payload) => fetch('/api/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'traceparent': createTraceparent()
+        },
+        body: JSON.stringify({ ...payload, stream: true, slim: true })
+    });
+
+    let response;
+    if (conversationId) {
+        response = await post({ conversation_id: conversationId, message: message });
+
+        // The session expired or lives on another instance; fall back to full history
+        if (response.status === 409) {
+            conversationId = null;
+        }
+    }
+
+    if (!conversationId) {
+        response = await post({ messages: messageHistory });
+    }
+
+    conversationId = response.headers.get('X-Conversation-Id') || null;
+    return response;
+}
+
+/**
+ * Parse a Server-Sent Events body, invoking a callback for each data payload
+ * @param {Response} response - Fetch response with an event-stream body
+ * @param {function(string): void} onData - Called with each event's data field
+ */
+async function readEventStream(response, onData) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+
+        // Only complete lines are processed; the remainder waits for more bytes
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            // Lines starting with ':' are keep-alive comments
+            if (line.startsWith('data:')) {
+                onData(line.slice(5).trim());
+            }
+        }
+    }
+}
+
+/**
+ * Render assistant tokens incrementally as they stream in
+ * @param {Response} response - Fetch response with an event-stream body
+ * @returns {Promise<string>} The full assistant message
+ */
+async function renderStreamedResponse(response) {
+    let assistantContent = '';
+    let textDiv = null;
+    let streamError = null;
+
+    await readEventStream(response, (data) => {
+        if (data === '[DONE]') return;
+
+        let chunk;
+        try {
+            chunk = JSON.parse(data);
+        } catch (e) {
+            return;
+        }
+
+        if (chunk.error) {
+            streamError = chunk.error.message || 'AI service error';
+            return;
+        }
+
+        const delta = chunk.choices?.[0]?.delta?.content;
+        if (!delta) return;
+
+        assistantContent += delta;
+
+        // Swap the typing indicator for a message bubble on the first token
+        if (!textDiv) {
+            removeTypingIndicator();
+            const assistantMessage = createMessageElement('assistant', assistantContent);
+            messagesArea.appendChild(assistantMessage);
+            textDiv = assistantMessage.querySelector('.message-text');
+        } else {
+            textDiv.innerHTML = formatMessageText(assistantContent);
+        }
+        scrollToBottom();
+    });
+
+    if (streamError && !assistantContent) {
+        removeTypingIndicator();
+        throw new Error(streamError);
+    }
+
+    if (!textDiv) {
+        removeTypingIndicator();
+        assistantContent = 'No response received.';
+        messagesArea.appendChild(createMessageElement('assistant', assistantContent));
+        scrollToBottom();
+    } else if (streamError) {
+        showErrorMessage(`Response interrupted: ${streamError}`);
+    }
+
+    return assistantContent;
+}
+
 // ==================== Clear Chat ====================
 
 /**
@@ -434,6 +572,7 @@ async function sendMessage(text, image) {
 function clearChat() {
     // Clear message history
     messageHistory = [];
+    conversationId = null;
 
     // Clear messages area
     messagesArea.innerHTML = '';
@@ -0,0 +1,4 @@
+"""
+Form Builder Bug Report - Self-Hosted Server
+Entry points for running the chat API outside of Vercel
+"""
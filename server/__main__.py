@@ -0,0 +1,183 @@
+"""
+Form Builder Bug Report - Standalone Server
+Serves the chat API, its metrics and the static frontend with a thread pool per process
+
+Run with: python -m server --port 8000 --threads 32 --workers 4
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+import os
+import signal
+import threading
+
+from api import batch, chat
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'public')
+
+
+class ServerHandler(chat.handler, SimpleHTTPRequestHandler):
+    """Routes /api/chat, /api/batch and /api/metrics to their handlers and everything else to public/"""
+
+    def api_path(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        return path if path in ('/api/chat', '/api/batch', '/api/metrics') else None
+
+    def is_api_request(self):
+        return self.api_path() is not None
+
+    def do_GET(self):
+        if self.api_path() == '/api/metrics' and getattr(self.server, 'forked', False):
+            # Each scrape would reach a different worker's counters and look like a reset
+            self.send_error_response(404, 'Metrics are per process; serve them with --workers 1')
+        elif self.api_path() == '/api/metrics':
+            self.send_metrics()
+        elif self.api_path() == '/api/batch':
+            batch.handler.do_GET(self)
+        elif self.is_api_request():
+            chat.handler.do_GET(self)
+        else:
+            SimpleHTTPRequestHandler.do_GET(self)
+
+    def do_HEAD(self):
+        if self.is_api_request():
+            self.send_error(405)
+        else:
+            SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def do_POST(self):
+        if self.api_path() == '/api/batch':
+            batch.handler.do_POST(self)
+        elif self.api_path() == '/api/chat':
+            chat.handler.do_POST(self)
+        else:
+            self.send_error_response(404, 'Not found')
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP server that handles connections on a bounded thread pool
+
+    A connection is only accepted once a thread is free to handle it, so
+    excess connections wait in the listen backlog (and, with --workers,
+    go to a less busy worker) instead of piling up in the process.
+    """
+
+    def __init__(self, server_address, handler_class, threads, backlog, bind_and_activate=True):
+        # Must be set before the socket starts listening
+        self.request_queue_size = backlog
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='chat')
+        self.free_threads = threading.BoundedSemaphore(threads)
+        self.forked = False
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    def get_request(self):
+        self.free_threads.acquire()
+        try:
+            request, client_address = self.socket.accept()
+        except BaseException:
+            self.free_threads.release()
+            raise
+        # The listener may be non-blocking; connections must not be
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        try:
+            self.executor.submit(self.process_request_thread, request, client_address)
+        except BaseException:
+            self.free_threads.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_threads.release()
+
+    def drain(self):
+        """Wait for in-flight requests to finish, then release the socket"""
+        self.executor.shutdown(wait=True)
+        self.server_close()
+
+
+def serve(server):
+    """Serve until SIGTERM or SIGINT, then finish in-flight requests"""
+    def request_shutdown(signum, frame):
+        # shutdown() blocks until serve_forever returns, so call it off-thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    server.serve_forever()
+    server.drain()
+
+
+def run_prefork(server, workers):
+    """Fork worker processes that accept from the shared listening socket"""
+    # Workers race for each connection; losers must not block in accept()
+    server.socket.setblocking(False)
+    server.forked = True
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(server)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+    server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m server', description=__doc__.strip().splitlines()[1])
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--threads', type=int, default=32, help='request threads per worker process')
+    parser.add_argument('--workers', type=int, default=1, help='pre-forked worker processes (POSIX only)')
+    parser.add_argument('--backlog', type=int, default=128, help='listen queue length')
+    parser.add_argument('--static-dir', default=STATIC_DIR, help='directory served for non-API paths')
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and not hasattr(os, 'fork'):
+        parser.error('--workers requires a platform with os.fork()')
+
+    chat.configure_hedging(args.threads)
+    handler_class = partial(ServerHandler, directory=args.static_dir)
+    server = PooledHTTPServer((args.host, args.port), handler_class, args.threads, args.backlog)
+    print(f'Serving on http://{args.host}:{args.port} '
+          f'({args.workers} worker(s) x {args.threads} threads)', flush=True)
+
+    if args.workers > 1:
+        run_prefork(server, args.workers)
+    else:
+        serve(server)
+
+
+if __name__ == '__main__':
+    main()
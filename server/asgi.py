@@ -0,0 +1,564 @@
+"""
+Form Builder Bug Report - ASGI Application
+Asyncio entry point serving the /api/chat and /api/batch contracts, plus
+/api/metrics, for self-hosted deployments
+
+Run with: uvicorn server.asgi:app --workers 4
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import multiprocessing
+import os
+import time
+from urllib.parse import parse_qs
+import uuid
+
+import httpx
+
+from api import batch, chat
+from api._body import parse_body
+from api._ratelimit import RateLimited
+from api._report import ReportStreamGuard
+from api._timing import RequestTiming
+from api._tracing import span as trace_span
+
+CHAT_PATH = '/api/chat'
+BATCH_PATH = '/api/batch'
+METRICS_PATH = '/api/metrics'
+
+# uvicorn --workers starts each worker through multiprocessing, and uvicorn and
+# gunicorn both read their worker count from WEB_CONCURRENCY
+FORKED = multiprocessing.parent_process() is not None or int(os.environ.get('WEB_CONCURRENCY', 1)) > 1
+
+# Each in-flight model call holds one upstream connection
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', 500))
+
+# Each running batch holds one thread waiting on its items; more batches queue
+BATCH_MAX_STREAMS = int(os.environ.get('BATCH_MAX_STREAMS', 16))
+
+# Kept apart from the default executor so batches cannot starve the chat path
+batch_streams = ThreadPoolExecutor(max_workers=BATCH_MAX_STREAMS, thread_name_prefix='batch-stream')
+
+
+async def read_request_body(receive, limit):
+    """Collect the request body from ASGI messages, enforcing a size limit"""
+    buffer = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError('Client disconnected')
+        buffer += message.get('body', b'')
+        if len(buffer) > limit:
+            raise chat.ChatRequestError(413, f'Request body exceeds {limit} bytes')
+        if not message.get('more_body', False):
+            return buffer
+
+
+def close_discarded(task):
+    """Release the connection held by a hedge race loser"""
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().response.aclose())
+
+
+async def watch_disconnect(receive, disconnected):
+    """Flag the request as abandoned once the client goes away"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+class ChatApp:
+    """ASGI application sharing one non-blocking upstream client per process"""
+
+    def __init__(self):
+        self.client = None
+
+    def get_client(self):
+        """Return the shared async client, creating it on first use"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=chat.REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=chat.UPSTREAM_POOL_MAXSIZE
+                )
+            )
+        return self.client
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path'].rstrip('/')
+        if path == METRICS_PATH and scope['method'] == 'GET' and chat.METRICS and FORKED:
+            # Each scrape would reach a different worker's counters and look like a reset
+            await self.send_json(send, 404, {'error': 'Metrics are per process; serve them with --workers 1'})
+            return
+        if path == METRICS_PATH and scope['method'] == 'GET' and chat.METRICS:
+            body = chat.metrics.render().encode('utf-8')
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', chat.METRICS_CONTENT_TYPE.encode('latin-1')),
+                            (b'content-length', str(len(body)).encode('latin-1'))]
+            })
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        if path not in (CHAT_PATH, BATCH_PATH):
+            await self.send_json(send, 404, {'error': 'Not found'})
+            return
+
+        method = scope['method']
+        if path == BATCH_PATH and method != 'OPTIONS':
+            if method == 'POST':
+                await self.handle_batch(scope, receive, send)
+            else:
+                await self.send_json(send, 405, {'error': 'Use POST to submit a batch'})
+            return
+
+        if method == 'OPTIONS':
+            await self.send_body(send, 200, b'')
+        elif method == 'GET':
+            await self.send_json(send, 200, {
+                'status': 'ok',
+                'models': chat.model_router.snapshot(),
+                'hedges': dict(chat.hedge_stats),
+                'tokens': chat.get_token_stats(),
+                'coalescing': chat.single_flight.in_flight()
+            })
+        elif method == 'POST':
+            await self.handle_post(scope, receive, send)
+        else:
+            await self.send_json(send, 405, {'error': 'Method not allowed'})
+
+    async def lifespan(self, receive, send):
+        """Open the upstream client on startup and close it on shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.get_client()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    await self.client.aclose()
+                    self.client = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def send_start(self, send, status_code, content_type, extra_headers=None):
+        """Send the response status line and headers"""
+        headers = list(chat.CORS_HEADERS) + [('Content-Type', content_type)]
+        headers += list((extra_headers or {}).items())
+        await send({
+            'type': 'http.response.start',
+            'status': status_code,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+
+    async def send_body(self, send, status_code, body, extra_headers=None):
+        """Send a complete JSON response from already-encoded bytes"""
+        headers = dict(extra_headers or {})
+        headers['Content-Length'] = str(len(body))
+        await self.send_start(send, status_code, 'application/json', headers)
+        await send({'type': 'http.response.body', 'body': bytes(body)})
+
+    async def send_json(self, send, status_code, data, extra_headers=None):
+        """Send a JSON response"""
+        await self.send_body(send, status_code, json.dumps(data).encode('utf-8'), extra_headers)
+
+    async def send_completion(self, send, completion_body, slim, extra_headers):
+        """Relay a completion body verbatim, or only its text and usage"""
+        if slim:
+            await self.send_json(send, 200, chat.slim_completion(completion_body), extra_headers)
+        else:
+            await self.send_body(send, 200, completion_body, extra_headers)
+
+    async def handle_post(self, scope, receive, send):
+        """Handle POST requests to the chat endpoint, timing each phase"""
+        timing = RequestTiming()
+        request_id = uuid.uuid4().hex
+        timing.note(request_id=request_id, method='POST', path=scope['path'])
+        extra_headers = {'X-Request-Id': request_id}
+
+        async def timed_send(message):
+            # Stamp the phases so far on the response and count what is sent
+            if message['type'] == 'http.response.start':
+                timing.note(status=message['status'])
+                if chat.SERVER_TIMING:
+                    message['headers'].append((b'server-timing', timing.header().encode('latin-1')))
+            elif message['type'] == 'http.response.body':
+                body = message.get('body', b'')
+                timing.note(response_bytes=timing.fields.get('response_bytes', 0) + len(body))
+                if body.startswith(b'data: '):
+                    timing.mark('ttft')
+            await send(message)
+
+        traceparent = next((value.decode('latin-1') for name, value in scope['headers'] if name == b'traceparent'), None)
+        chat.requests_in_flight.inc()
+        try:
+            with chat.trace_request('POST /api/chat', traceparent) as root:
+                if root is not None:
+                    timing.note(trace_id=root.trace_id)
+                await self.handle_chat(scope, receive, timed_send, extra_headers, timing)
+                if root is not None:
+                    chat.trace_response(root, timing)
+        finally:
+            chat.requests_in_flight.dec()
+            chat.finish_request(timing, extra_headers)
+
+    async def handle_chat(self, scope, receive, send, extra_headers, timing):
+        """Handle one chat request; mirrors chat.handler.handle_chat"""
+        request_headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                           for name, value in scope['headers']}
+        try:
+            # Reject oversized bodies before reading them
+            content_length = int(request_headers.get('content-length', 0))
+            timing.note(request_bytes=content_length)
+            if content_length > chat.MAX_BODY_BYTES:
+                raise chat.ChatRequestError(413, f'Request body exceeds {chat.MAX_BODY_BYTES} bytes')
+
+            try:
+                with trace_span('parse', **{'http.request.body.size': content_length}):
+                    with timing.phase('read'):
+                        raw = await read_request_body(receive, chat.MAX_BODY_BYTES)
+                    with timing.phase('parse'):
+                        body = parse_body(raw)
+            except json.JSONDecodeError:
+                raise chat.ChatRequestError(400, 'Invalid JSON in request body')
+            except ValueError as e:
+                raise chat.ChatRequestError(400, str(e))
+
+            api_key = os.environ.get('OPENROUTER_API_KEY')
+            if not api_key:
+                raise chat.ChatRequestError(500, 'API key not configured. Please set OPENROUTER_API_KEY environment variable.')
+
+            # Image processing and store lookups block, so keep them off the event loop
+            with trace_span('build-messages') as build, timing.phase('prepare'):
+                messages, conversation_id = await asyncio.to_thread(chat.resolve_messages, body, extra_headers)
+                variant = chat.choose_prompt_variant(body.get('prompt_variant'), conversation_id)
+                images = sum(chat.content_parts(msg)[1] for msg in messages)
+                if build is not None:
+                    build.set(messages=len(messages), images=images, prompt_variant=variant)
+            system_prompt = chat.PROMPT_VARIANTS[variant]
+            extra_headers['X-Prompt-Variant'] = variant
+            timing.note(images=images)
+
+            slim = body.get('slim') is True
+            with timing.phase('cache'):
+                key = chat.response_cache_key(system_prompt, messages)
+                cached = await asyncio.to_thread(chat.cache_lookup, key)
+            if chat.response_cache is not None:
+                extra_headers['X-Cache'] = 'HIT' if cached is not None else 'MISS'
+            if cached is not None:
+                await self.send_completion(send, cached, slim, extra_headers)
+                await asyncio.to_thread(chat.save_conversation, conversation_id, messages, cached)
+                return
+
+            # Share an identical in-flight request instead of calling the model again
+            leader = True
+            if chat.SINGLE_FLIGHT:
+                flight, leader = chat.single_flight.join(key)
+                if not leader:
+                    try:
+                        with timing.phase('coalesce'):
+                            completion_body = await asyncio.wait_for(asyncio.wrap_future(flight), chat.COALESCE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        completion_body = None
+                    if completion_body is not None:
+                        extra_headers['X-Coalesced'] = '1'
+                        timing.note(coalesced=True)
+                        await self.send_completion(send, completion_body, slim, extra_headers)
+                        await asyncio.to_thread(chat.save_conversation, conversation_id, messages, completion_body)
+                        return
+
+            completion_body = None
+            try:
+                peer = (scope.get('client') or ('unknown', 0))[0]
+                client = chat.client_id(request_headers, peer)
+                try:
+                    delay = chat.rate_limiter.admit(client)
+                except RateLimited as e:
+                    extra_headers['Retry-After'] = str(e.retry_after)
+                    raise chat.ChatRequestError(429, 'Too many requests. Please retry shortly.')
+                if delay:
+                    try:
+                        with timing.phase('queue'):
+                            await asyncio.sleep(delay)
+                    finally:
+                        chat.rate_limiter.release()
+
+                stream = chat.wants_stream(body, request_headers.get('accept'))
+                timing.note(stream=stream)
+                try:
+                    with timing.phase('upstream'), trace_span('upstream', stream=stream):
+                        if stream:
+                            deadline = time.monotonic() + chat.REQUEST_TIMEOUT
+                            reply = await self.run_plan(
+                                chat.call_upstream(api_key, messages, True, extra_headers, system_prompt, deadline)
+                            )
+                        else:
+                            completion_body = await self.run_plan(
+                                chat.complete_report(api_key, messages, extra_headers, system_prompt, client)
+                            )
+                except chat.ChatRequestError as e:
+                    timing.note(upstream_status=e.status_code)
+                    raise
+                timing.note(upstream_status=200)
+
+                if stream:
+                    model = extra_headers.get('X-Model', chat.MODEL)
+                    with timing.phase('stream'), trace_span('serialize', stream=True):
+                        completion_body = await self.relay_stream(
+                            receive, send, reply, extra_headers,
+                            chat.continuation_request(api_key, messages, system_prompt, model, True, client, deadline)
+                        )
+                else:
+                    try:
+                        with timing.phase('write'), trace_span('serialize', slim=slim):
+                            await self.send_completion(send, completion_body, slim, extra_headers)
+                    except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+                        raise chat.ChatRequestError(502, 'Invalid response from AI service')
+
+                if completion_body is not None:
+                    timing.note(**chat.completion_usage(completion_body))
+                    await asyncio.to_thread(chat.cache_store, key, completion_body)
+            finally:
+                if chat.SINGLE_FLIGHT and leader:
+                    chat.single_flight.finish(key, completion_body)
+
+            if completion_body is not None:
+                await asyncio.to_thread(chat.save_conversation, conversation_id, messages, completion_body)
+
+        except chat.ChatRequestError as e:
+            await self.send_json(send, e.status_code, {'error': e.message}, extra_headers)
+        except ConnectionResetError:
+            return
+        except Exception as e:
+            await self.send_json(send, 500, {'error': f'Internal server error: {str(e)}'}, extra_headers)
+
+    async def handle_batch(self, scope, receive, send):
+        """Handle POST requests to the batch endpoint; mirrors batch.handler.do_POST
+
+        Items run on worker threads through batch.run_batch, which bounds
+        their concurrency, and each result is sent as soon as it is ready.
+        The batch itself is driven from the batch_streams pool.
+        """
+        extra_headers = {}
+        request_headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                           for name, value in scope['headers']}
+        try:
+            content_length = int(request_headers.get('content-length', 0))
+            if content_length > chat.MAX_BODY_BYTES:
+                raise chat.ChatRequestError(413, f'Request body exceeds {chat.MAX_BODY_BYTES} bytes')
+
+            raw = await read_request_body(receive, chat.MAX_BODY_BYTES)
+            try:
+                batch_id, variant, items = batch.parse_items(raw, request_headers.get('content-type', ''))
+            except json.JSONDecodeError:
+                raise chat.ChatRequestError(400, 'Invalid JSON in request body')
+            except ValueError as e:
+                raise chat.ChatRequestError(400, str(e))
+            ids = [batch.item_id(item, index) for index, item in enumerate(items)]
+            if len(set(ids)) != len(ids):
+                raise chat.ChatRequestError(400, 'Item ids must be unique within a batch')
+
+            api_key = os.environ.get('OPENROUTER_API_KEY')
+            if not api_key:
+                raise chat.ChatRequestError(500, 'API key not configured. Please set OPENROUTER_API_KEY environment variable.')
+        except chat.ChatRequestError as e:
+            await self.send_json(send, e.status_code, {'error': e.message}, extra_headers)
+            return
+        except ConnectionResetError:
+            return
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        batch_id = str(
+            (query.get('batch_id') or [None])[0] or request_headers.get('x-batch-id') or batch_id or uuid.uuid4().hex
+        )
+        extra_headers['X-Batch-Id'] = batch_id
+        peer = (scope.get('client') or ('unknown', 0))[0]
+        client = chat.client_id(request_headers, peer)
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+        stream_headers = dict(extra_headers)
+        stream_headers['Cache-Control'] = 'no-cache'
+        stream_headers['X-Accel-Buffering'] = 'no'
+        await self.send_start(send, 200, batch.NDJSON_CONTENT_TYPE, stream_headers)
+
+        loop = asyncio.get_running_loop()
+        results = []
+        lines = batch.run_batch(api_key, batch_id, items, variant, client)
+        try:
+            while True:
+                result = await loop.run_in_executor(batch_streams, next, lines, None)
+                if result is None:
+                    break
+                if disconnected.is_set():
+                    # Completed items stay stored for a resume
+                    return
+                results.append(result)
+                await send({'type': 'http.response.body', 'body': json.dumps(result).encode('utf-8') + b'\n', 'more_body': True})
+            summary = json.dumps(batch.batch_summary(batch_id, results)).encode('utf-8')
+            await send({'type': 'http.response.body', 'body': summary + b'\n'})
+        finally:
+            watcher.cancel()
+            await loop.run_in_executor(batch_streams, lines.close)
+
+    async def run_plan(self, plan, relay=None):
+        """Drive a chat pipeline plan with non-blocking I/O; counterpart of chat.run_plan"""
+        result = error = None
+        while True:
+            try:
+                op = plan.send(result) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                if isinstance(op, chat.Send):
+                    result = await self.send_upstream(op)
+                elif isinstance(op, chat.Sleep):
+                    await asyncio.sleep(op.delay)
+                elif isinstance(op, chat.Race):
+                    result = await self.race(op)
+                else:
+                    await relay(op)
+            except BaseException as e:
+                # Cancellation too, so the plan's spans are closed in this task
+                error = e
+
+    async def send_upstream(self, op):
+        """Perform a chat.Send with the shared async client
+
+        Streamed responses are returned open and must be closed by the caller.
+        """
+        client = self.get_client()
+        request = client.build_request(
+            'POST', chat.OPENROUTER_API_URL, headers=op.headers, json=op.payload, timeout=op.timeout
+        )
+        started = time.monotonic()
+        try:
+            # Always streamed, so elapsed stops at the headers as in chat.send_upstream
+            response = await client.send(request, stream=True)
+            elapsed = time.monotonic() - started
+            body = None
+            if response.status_code != 200 or not op.stream:
+                try:
+                    body = await response.aread()
+                finally:
+                    await response.aclose()
+        except httpx.TimeoutException:
+            raise chat.UpstreamTimeout()
+        except httpx.HTTPError as e:
+            raise chat.UpstreamUnreachable(str(e))
+        return chat.UpstreamReply(response.status_code, response.headers, elapsed, body, response)
+
+    async def race(self, op):
+        """Perform a chat.Race with tasks; the loser is cancelled, which closes its connection"""
+        first = asyncio.create_task(self.run_plan(op.first))
+        done, _ = await asyncio.wait({first}, timeout=op.delay)
+        if done:
+            return first.result(), 0
+
+        second = asyncio.create_task(self.run_plan(op.second()))
+        pending = {first: 0, second: 1}
+        error = None
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                try:
+                    reply = task.result()
+                except chat.ChatRequestError as e:
+                    error = e
+                    continue
+
+                for loser in pending:
+                    loser.cancel()
+                    loser.add_done_callback(close_discarded)
+                return reply, index
+
+        raise error
+
+    async def relay_stream(self, receive, send, reply, extra_headers, continue_stream=None):
+        """Forward upstream SSE lines as they arrive; mirrors handler.relay_stream
+
+        Returns the completion body assembled from the streamed deltas, or
+        None if the stream did not finish cleanly.
+        """
+        collector = chat.StreamCollector(
+            ReportStreamGuard() if chat.REPORT_STREAM_CUTOFF else None,
+            continuable=continue_stream is not None and chat.MAX_CONTINUATIONS > 0
+        )
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+
+        stream_headers = dict(extra_headers)
+        stream_headers['Cache-Control'] = 'no-cache'
+        stream_headers['X-Accel-Buffering'] = 'no'
+        await self.send_start(send, 200, chat.STREAM_CONTENT_TYPE, stream_headers)
+
+        try:
+            await self.run_plan(
+                chat.relay_report(reply, collector, continue_stream),
+                lambda op: self.relay_lines(op, send, disconnected)
+            )
+            if collector.done_withheld:
+                await send({'type': 'http.response.body', 'body': b'data: [DONE]\n\n', 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+            completion_body = collector.result()
+            if completion_body is not None:
+                chat.record_usage(completion_body)
+            return completion_body
+
+        except ConnectionResetError:
+            return None
+        except httpx.TimeoutException:
+            error = 'AI service stream timed out'
+        except httpx.HTTPError as e:
+            error = f'AI service stream interrupted: {str(e)}'
+        finally:
+            watcher.cancel()
+
+        # Headers are already sent, so report the failure as an SSE event
+        error_event = {'error': {'message': error}}
+        await send({'type': 'http.response.body', 'body': f'data: {json.dumps(error_event)}\n\n'.encode('utf-8')})
+        return None
+
+    async def relay_lines(self, op, send, disconnected):
+        """Perform a chat.Relay step for relay_stream"""
+        collector = op.collector
+        try:
+            pending = b''
+            async for chunk in op.response.aiter_bytes():
+                if disconnected.is_set():
+                    # Closing the response below stops upstream generation
+                    raise ConnectionResetError('Client disconnected')
+
+                # Forward whole lines so the collector can withhold text past the report
+                *lines, pending = (pending + chunk).split(b'\n')
+                forward = []
+                for line in lines:
+                    line = line.rstrip(b'\r')
+                    forward.extend(collector.feed(line) if line else [line])
+                    if collector.stopped:
+                        break
+                if forward:
+                    await send({'type': 'http.response.body', 'body': b'\n'.join(forward) + b'\n', 'more_body': True})
+                if collector.stopped:
+                    return
+            if pending:
+                forward = collector.feed(pending)
+                await send({'type': 'http.response.body', 'body': b'\n'.join(forward) + b'\n', 'more_body': True})
+        finally:
+            await op.response.aclose()
+
+
+app = ChatApp()
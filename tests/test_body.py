@@ -0,0 +1,88 @@
+"""
+Form Builder Bug Report - Request Body Tests
+Parsing with base64 images lifted out as DataURI views in api/_body.py
+"""
+
+import io
+import json
+
+import pytest
+
+from api._body import DataURI, materialize_data_uris, parse_body, read_body
+
+IMAGE = 'data:image/png;base64,iVBORw0KGgo='
+
+
+def image_message(url=IMAGE):
+    return {'role': 'user', 'content': [
+        {'type': 'text', 'text': 'The button is misaligned'},
+        {'type': 'image_url', 'image_url': {'url': url}}
+    ]}
+
+
+def test_plain_body_parses_as_json():
+    body = {'messages': [{'role': 'user', 'content': 'Submit does nothing'}]}
+    assert parse_body(json.dumps(body).encode('utf-8')) == body
+
+
+def test_data_uri_becomes_a_view():
+    parsed = parse_body(json.dumps({'messages': [image_message()]}).encode('utf-8'))
+    url = parsed['messages'][0]['content'][1]['image_url']['url']
+    assert isinstance(url, DataURI)
+    assert url.mime_type == 'image/png'
+    assert str(url) == IMAGE
+    assert len(url) == len(IMAGE)
+
+
+def test_materialized_body_matches_json():
+    body = {'messages': [image_message(), image_message()]}
+    parsed = parse_body(json.dumps(body, indent=2).encode('utf-8'))
+    assert materialize_data_uris(parsed['messages']) == body['messages']
+
+
+def test_key_ending_in_url_is_left_alone():
+    raw = b'{"a\\"url": "' + IMAGE.encode('ascii') + b'"}'
+    assert parse_body(raw) == {'a"url': IMAGE}
+
+
+def test_key_ending_in_image_url_is_left_alone():
+    raw = b'{"a\\"image_url": {"url": "' + IMAGE.encode('ascii') + b'"}}'
+    assert parse_body(raw) == {'a"image_url': {'url': IMAGE}}
+
+
+def test_url_outside_image_url_stays_a_string():
+    body = {'messages': [{'role': 'user', 'content': [{'type': 'image', 'url': IMAGE}]}]}
+    parsed = parse_body(json.dumps(body).encode('utf-8'))
+    assert parsed == body
+    json.dumps(parsed)
+
+
+def test_image_url_with_url_after_other_keys_stays_a_string():
+    part = {'type': 'image_url', 'image_url': {'detail': 'low', 'url': IMAGE}}
+    body = {'messages': [{'role': 'user', 'content': [part]}]}
+    assert parse_body(json.dumps(body).encode('utf-8')) == body
+
+
+def test_data_uri_inside_text_is_left_alone():
+    text = json.dumps({'url': IMAGE})
+    body = {'messages': [{'role': 'user', 'content': text}]}
+    assert parse_body(json.dumps(body).encode('utf-8')) == body
+
+
+def test_remote_url_is_left_alone():
+    body = {'messages': [image_message('https://example.com/screenshot.png')]}
+    assert parse_body(json.dumps(body).encode('utf-8')) == body
+
+
+def test_invalid_json_raises():
+    with pytest.raises(json.JSONDecodeError):
+        parse_body(b'{"messages": [')
+
+
+def test_read_body_reads_exactly_content_length():
+    assert bytes(read_body(io.BytesIO(b'{"a": 1}trailing'), 8)) == b'{"a": 1}'
+
+
+def test_read_body_rejects_a_short_body():
+    with pytest.raises(ValueError):
+        read_body(io.BytesIO(b'{"a"'), 8)
@@ -0,0 +1,120 @@
+"""
+Form Builder Bug Report - Circuit Breaker Tests
+State changes in api/_breaker.py and probe handling in request_model
+"""
+
+import pytest
+
+from api import chat
+from api._breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from api._routing import ModelRouter
+from api.chat import ChatRequestError, Send, UpstreamReply, request_model
+
+MESSAGES = [{'role': 'user', 'content': 'Export button does nothing'}]
+
+
+def tripped_breaker():
+    breaker = CircuitBreaker(window=4, min_samples=2, open_seconds=30, probe_timeout=60)
+    breaker.record(False, 1.0, 0)
+    breaker.record(False, 1.0, 0)
+    return breaker
+
+
+def test_errors_open_the_breaker():
+    breaker = CircuitBreaker(window=4, min_samples=2)
+    breaker.record(False, 1.0, 0)
+    assert breaker.current_state(0) == CLOSED
+    breaker.record(False, 1.0, 0)
+    assert breaker.current_state(0) == OPEN
+    assert not breaker.allow(10)
+    assert breaker.remaining(10) == 20
+
+
+def test_slow_calls_open_the_breaker():
+    breaker = CircuitBreaker(window=4, min_samples=2, slow_call_seconds=5)
+    breaker.record(True, 9.0, 0)
+    breaker.record(True, 9.0, 0)
+    assert breaker.current_state(0) == OPEN
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = tripped_breaker()
+    assert breaker.current_state(30) == HALF_OPEN
+    assert breaker.allow(30)
+    assert not breaker.allow(31)
+
+
+def test_successful_probe_closes_the_breaker():
+    breaker = tripped_breaker()
+    breaker.allow(30)
+    breaker.record(True, 1.0, 31)
+    assert breaker.current_state(31) == CLOSED
+    assert breaker.allow(31)
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = tripped_breaker()
+    breaker.allow(30)
+    breaker.record(False, 1.0, 31)
+    assert breaker.current_state(31) == OPEN
+    assert breaker.current_state(61) == HALF_OPEN
+
+
+def test_lost_probe_is_replaced_after_probe_timeout():
+    breaker = tripped_breaker()
+    breaker.allow(30)
+    assert not breaker.allow(89)
+    assert breaker.allow(90)
+
+
+def test_released_probe_frees_the_slot():
+    breaker = tripped_breaker()
+    breaker.allow(30)
+    breaker.release()
+    assert breaker.current_state(31) == HALF_OPEN
+    assert breaker.allow(31)
+
+
+@pytest.fixture
+def half_open_router(monkeypatch):
+    router = ModelRouter(['model'], breaker={'window': 2, 'min_samples': 1, 'open_seconds': 0})
+    router.record('model', 1.0, False)
+    monkeypatch.setattr(chat, 'model_router', router)
+    return router
+
+
+def probe(router):
+    """Start request_model up to its Send, taking the half-open probe"""
+    plan = request_model('model', 'key', MESSAGES, False)
+    assert isinstance(next(plan), Send)
+    with pytest.raises(ChatRequestError) as raised:
+        next(request_model('model', 'key', MESSAGES, False))
+    assert raised.value.status_code == 503
+    return plan
+
+
+def test_client_error_releases_the_probe(half_open_router):
+    plan = probe(half_open_router)
+    with pytest.raises(ChatRequestError):
+        plan.send(UpstreamReply(400, {}, 0.1, b'{}', None))
+    assert half_open_router.allow('model')
+
+
+def test_cancelled_probe_is_released(half_open_router):
+    plan = probe(half_open_router)
+    plan.close()
+    assert half_open_router.allow('model')
+
+
+def test_crashed_probe_is_released(half_open_router):
+    plan = probe(half_open_router)
+    with pytest.raises(RuntimeError):
+        plan.throw(RuntimeError('connection pool closed'))
+    assert half_open_router.allow('model')
+
+
+def test_successful_probe_closes_the_model_breaker(half_open_router):
+    plan = probe(half_open_router)
+    with pytest.raises(StopIteration):
+        plan.send(UpstreamReply(200, {}, 0.1, b'{}', None))
+    assert half_open_router.breakers['model'].state == CLOSED
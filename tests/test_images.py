@@ -0,0 +1,46 @@
+"""
+Form Builder Bug Report - Image Ingestion Tests
+Screenshot shrinking and the pass-through cases in api/_images.py
+"""
+
+import base64
+import io
+
+import pytest
+
+from api._images import process_images
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png_uri(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def image_messages(url):
+    return [{'role': 'user', 'content': [{'type': 'image_url', 'image_url': {'url': url}}]}]
+
+
+def test_large_screenshot_is_downscaled():
+    processed, stats = process_images(image_messages(png_uri(800, 400)), 100, 'JPEG', 80, 10_000_000)
+    url = processed[0]['content'][0]['image_url']['url']
+    assert url.startswith('data:image/jpeg;base64,')
+    image = Image.open(io.BytesIO(base64.b64decode(url.split(',', 1)[1])))
+    assert image.size == (100, 50)
+    assert stats['images'] == 1
+
+
+def test_image_over_the_pixel_limit_is_forwarded_undecoded():
+    url = png_uri(400, 400)
+    processed, stats = process_images(image_messages(url), 100, 'JPEG', 80, 400 * 399)
+    assert processed[0]['content'][0]['image_url']['url'] == url
+    assert stats['bytes_after'] == stats['bytes_before']
+
+
+def test_non_image_parts_are_forwarded():
+    messages = [{'role': 'user', 'content': ['bare', {'type': 'image_url', 'image_url': 'data:image/png;base64,AA'}]}]
+    processed, stats = process_images(messages, 100, 'JPEG', 80, 10_000_000)
+    assert processed == messages
+    assert stats['images'] == 0
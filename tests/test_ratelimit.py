@@ -0,0 +1,87 @@
+"""
+Form Builder Bug Report - Admission Control Tests
+Token bucket refill and queueing in api/_ratelimit.py
+"""
+
+import pytest
+
+from api import _ratelimit
+from api._ratelimit import RateLimited, RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic clock the tests advance by hand"""
+    now = [1000.0]
+    monkeypatch.setattr(_ratelimit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_its_rate_up_to_burst(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    for _ in range(3):
+        bucket.take()
+    assert bucket.delay_for_next(clock[0]) == 0.5
+    clock[0] += 1.0
+    bucket.refill(clock[0])
+    assert bucket.tokens == 2.0
+    clock[0] += 10.0
+    bucket.refill(clock[0])
+    assert bucket.tokens == 3.0
+
+
+def test_burst_is_admitted_without_waiting(clock):
+    limiter = RateLimiter(0, 0, 1.0, 2, max_queue=5, max_wait=30)
+    assert limiter.admit('a') == 0.0
+    assert limiter.admit('a') == 0.0
+    assert limiter.waiting == 0
+
+
+def test_requests_past_the_burst_queue_for_their_token(clock):
+    limiter = RateLimiter(0, 0, 1.0, 1, max_queue=5, max_wait=30)
+    limiter.admit('a')
+    assert limiter.admit('a') == 1.0
+    assert limiter.admit('a') == 2.0
+    assert limiter.waiting == 2
+    limiter.release()
+    assert limiter.waiting == 1
+
+
+def test_clients_have_separate_buckets(clock):
+    limiter = RateLimiter(0, 0, 1.0, 1, max_queue=5, max_wait=30)
+    limiter.admit('a')
+    assert limiter.admit('b') == 0.0
+
+
+def test_global_bucket_is_shared(clock):
+    limiter = RateLimiter(0.5, 1, 0, 0, max_queue=5, max_wait=30)
+    limiter.admit('a')
+    assert limiter.admit('b') == 2.0
+
+
+def test_wait_past_max_wait_is_rate_limited(clock):
+    limiter = RateLimiter(0, 0, 0.1, 1, max_queue=5, max_wait=5)
+    limiter.admit('a')
+    with pytest.raises(RateLimited) as raised:
+        limiter.admit('a')
+    assert raised.value.retry_after == 10
+    # A rejected request reserves nothing
+    assert limiter.waiting == 0
+    clock[0] += 10.0
+    assert limiter.admit('a') == 0.0
+
+
+def test_caller_max_wait_lowers_the_limit(clock):
+    limiter = RateLimiter(0, 0, 1.0, 1, max_queue=5, max_wait=30)
+    limiter.admit('a')
+    with pytest.raises(RateLimited):
+        limiter.admit('a', max_wait=0.5)
+
+
+def test_full_queue_is_rate_limited(clock):
+    limiter = RateLimiter(0, 0, 1.0, 1, max_queue=1, max_wait=30)
+    limiter.admit('a')
+    limiter.admit('a')
+    with pytest.raises(RateLimited) as raised:
+        limiter.admit('a')
+    assert raised.value.retry_after == 2
@@ -0,0 +1,143 @@
+"""
+Form Builder Bug Report - Report Structure Tests
+Validation, section repair and the stream cutoff guard in api/_report.py
+"""
+
+from api._report import (
+    ReportStreamGuard,
+    format_report,
+    merge_repair,
+    repair_targets,
+    report_sections,
+    validate_report
+)
+
+REPORT = """Summary:
+Submitting a form with a required date field fails.
+_______________________________________________________
+
+Title:
+Form Builder | Forms | Date Field | Submit fails when a required date is set
+_______________________________________________________
+
+Reproduce Steps:
+1. Add a required date field to a form
+2. Fill in the date and submit
+_______________________________________________________
+
+Actual Result:
+* An error is shown and nothing is saved
+_______________________________________________________
+
+Expected Result:
+* The record is saved
+* A confirmation is shown
+"""
+
+
+def stream(guard, text, size=7):
+    """Feed text through the guard in small chunks, as deltas arrive"""
+    return ''.join(guard.feed(text[i:i + size]) for i in range(0, len(text), size))
+
+
+def test_valid_report_has_no_problems():
+    assert validate_report(REPORT) == []
+
+
+def test_formatted_sections_round_trip():
+    assert validate_report(format_report(report_sections(REPORT))) == []
+
+
+def test_text_before_summary_is_reported():
+    problems = validate_report('Sure! Here is the report:\n' + REPORT)
+    assert (None, 'has text before Summary') in problems
+
+
+def test_missing_section_is_reported():
+    text = REPORT.split('Expected Result:')[0]
+    problems = validate_report(text)
+    assert (None, 'is missing Expected Result') in problems
+
+
+def test_title_without_four_parts_is_reported():
+    text = REPORT.replace('Form Builder | Forms | Date Field | Submit fails', 'Submit fails')
+    assert validate_report(text) == [('Title', 'must be one line: Area | Module | Component | Issue description')]
+
+
+def test_long_summary_is_reported():
+    text = REPORT.replace('date field fails.', 'date field fails. It breaks. Users leave.')
+    assert validate_report(text) == [('Summary', 'has 3 sentences (maximum 2)')]
+
+
+def test_unnumbered_steps_are_reported():
+    text = REPORT.replace('1. Add', 'Add')
+    assert validate_report(text) == [('Reproduce Steps', 'must be a numbered list')]
+
+
+def test_repair_targets_only_broken_sections():
+    sections = report_sections(REPORT.replace('* An error', 'An error'))
+    assert repair_targets(sections) == ['Actual Result']
+
+
+def test_merge_repair_uses_valid_replacements():
+    sections = report_sections(REPORT.replace('Form Builder | Forms | Date Field | ', ''))
+    reply = 'Title:\nForm Builder | Forms | Date Field | Submit fails\n'
+    merged, repaired = merge_repair(sections, ['Title'], reply)
+    assert repaired == ['Title']
+    assert merged['Title'] == ['Form Builder | Forms | Date Field | Submit fails']
+    assert merged['Summary'] == sections['Summary']
+
+
+def test_merge_repair_skips_invalid_replacements():
+    sections = report_sections(REPORT.replace('Form Builder | Forms | Date Field | ', ''))
+    merged, repaired = merge_repair(sections, ['Title'], 'Title:\nStill not four parts\n')
+    assert repaired == []
+    assert merged == sections
+
+
+def test_merge_repair_ignores_sections_not_asked_for():
+    sections = report_sections(REPORT)
+    reply = 'Summary:\nA different summary.\n'
+    merged, repaired = merge_repair(sections, ['Title'], reply)
+    assert repaired == []
+    assert merged['Summary'] == sections['Summary']
+
+
+def test_guard_passes_a_clean_report_through():
+    assert stream(ReportStreamGuard(), REPORT) == REPORT
+
+
+def test_guard_cuts_commentary_after_expected_result():
+    guard = ReportStreamGuard()
+    sent = stream(guard, REPORT + '\nLet me know if you need anything else!')
+    assert sent == REPORT + '\n'
+    assert guard.done
+
+
+def test_guard_cuts_a_repeated_report():
+    guard = ReportStreamGuard()
+    assert stream(guard, REPORT + '\n' + REPORT) == REPORT + '\n'
+
+
+def test_guard_keeps_indented_continuations():
+    text = REPORT + '  which matches the saved value\n'
+    assert stream(ReportStreamGuard(), text) == text
+
+
+def test_guard_keeps_an_unindented_wrapped_bullet():
+    text = REPORT + '* Respects the configured\nformat in all views\n'
+    guard = ReportStreamGuard()
+    assert stream(guard, text) == text
+    assert not guard.done
+
+
+def test_guard_ends_at_a_capitalised_line_after_a_finished_bullet():
+    guard = ReportStreamGuard()
+    assert stream(guard, REPORT + 'Note: this is a guess\n') == REPORT
+    assert guard.done
+
+
+def test_guard_waits_for_a_lone_bullet_character():
+    guard = ReportStreamGuard()
+    assert guard.feed(REPORT + '*') == REPORT
+    assert guard.feed(' Saved\n') == '* Saved\n'
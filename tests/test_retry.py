@@ -0,0 +1,112 @@
+"""
+Form Builder Bug Report - Upstream Retry Tests
+Fallback and backoff in the call_upstream plan of api/chat.py
+"""
+
+import time
+
+import pytest
+
+from api import chat
+from api._routing import ModelRouter
+from api.chat import ChatRequestError, Send, Sleep, UpstreamReply, call_upstream
+
+MESSAGES = [{'role': 'user', 'content': 'Export button does nothing'}]
+
+
+@pytest.fixture(autouse=True)
+def upstream(monkeypatch):
+    """Two models, no hedging and backoff at its upper bound"""
+    monkeypatch.setattr(chat, 'model_router', ModelRouter(['first', 'second']))
+    monkeypatch.setattr(chat, 'HEDGING', False)
+    monkeypatch.setattr(chat, 'RETRY_MAX_RETRIES', 2)
+    monkeypatch.setattr(chat, 'RETRY_BASE_DELAY', 0.5)
+    monkeypatch.setattr(chat.random, 'uniform', lambda low, high: high)
+
+
+def reply(status_code, retry_after=None):
+    headers = {'Retry-After': retry_after} if retry_after else {}
+    return UpstreamReply(status_code, headers, 0.1, b'{"error": {"message": "busy"}}', None)
+
+
+def drive(plan, replies):
+    """Answer each Send with the next reply; return the outcome, models sent to and sleeps"""
+    sent, slept = [], []
+    result = None
+    try:
+        while True:
+            op = plan.send(result)
+            if isinstance(op, Send):
+                sent.append(op.payload['model'])
+                result = replies.pop(0)
+            elif isinstance(op, Sleep):
+                slept.append(op.delay)
+                result = None
+    except StopIteration as stop:
+        return stop.value, sent, slept
+    except ChatRequestError as e:
+        return e, sent, slept
+
+
+def test_first_success_is_returned():
+    ok = reply(200)
+    headers = {}
+    outcome, sent, slept = drive(call_upstream('key', MESSAGES, False, headers), [ok])
+    assert outcome is ok
+    assert sent == ['first']
+    assert headers['X-Model'] == 'first'
+    assert headers['X-Retry-Count'] == '0'
+
+
+def test_server_error_falls_back_without_sleeping():
+    ok = reply(200)
+    headers = {}
+    outcome, sent, slept = drive(call_upstream('key', MESSAGES, False, headers), [reply(502), ok])
+    assert outcome is ok
+    assert sent == ['first', 'second']
+    assert slept == []
+    assert headers['X-Model'] == 'second'
+    assert headers['X-Upstream-Attempts'] == '2'
+
+
+def test_rate_limited_pass_waits_for_retry_after():
+    ok = reply(200)
+    headers = {}
+    replies = [reply(503), reply(429, '3'), ok]
+    outcome, sent, slept = drive(call_upstream('key', MESSAGES, False, headers), replies)
+    assert outcome is ok
+    assert slept == [3.0]
+    assert headers['X-Retry-Count'] == '1'
+
+
+def test_backoff_doubles_until_retries_run_out():
+    replies = [reply(500) for _ in range(6)]
+    headers = {}
+    outcome, sent, slept = drive(call_upstream('key', MESSAGES, False, headers), replies)
+    assert isinstance(outcome, ChatRequestError)
+    assert outcome.status_code == 500
+    assert len(sent) == 6
+    assert slept == [0.5, 1.0]
+    assert headers['X-Retry-Count'] == '2'
+
+
+def test_client_error_is_not_retried():
+    outcome, sent, slept = drive(call_upstream('key', MESSAGES, False, {}), [reply(400)])
+    assert outcome.status_code == 400
+    assert not outcome.retryable
+    assert sent == ['first']
+    assert slept == []
+
+
+def test_retry_after_past_the_deadline_fails_now():
+    replies = [reply(429), reply(429, '120')]
+    deadline = time.monotonic() + 30
+    outcome, sent, slept = drive(call_upstream('key', MESSAGES, False, {}, deadline=deadline), replies)
+    assert outcome.status_code == 429
+    assert outcome.retry_after == 120.0
+    assert slept == []
+
+
+def test_retry_after_accepts_an_http_date():
+    assert chat.parse_retry_after('Thu, 01 Jan 1970 00:00:00 GMT') == 0.0
+    assert chat.parse_retry_after('soon') is None
@@ -0,0 +1,48 @@
+"""
+Form Builder Bug Report - Stream Collector Tests
+SSE relaying, [DONE] handling and the report cutoff in api/chat.py
+"""
+
+import json
+
+from api._report import ReportStreamGuard
+from api.chat import StreamCollector
+from tests.test_report import REPORT
+
+
+def delta(text, finish_reason=None):
+    chunk = {'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': finish_reason}]}
+    return b'data: ' + json.dumps(chunk).encode('utf-8')
+
+
+def relay(collector, lines):
+    """Feed lines and add the trailing [DONE] the relay writes when withheld"""
+    forwarded = [out for line in lines for out in collector.feed(line)]
+    if collector.done_withheld:
+        forwarded.append(b'data: [DONE]')
+    return forwarded
+
+
+def test_complete_stream_is_forwarded_and_collected():
+    collector = StreamCollector()
+    lines = [delta('Summary:\n'), delta('Fails', 'stop'), b'data: [DONE]']
+    assert relay(collector, lines) == lines
+    assert json.loads(collector.result())['choices'][0]['message']['content'] == 'Summary:\nFails'
+
+
+def test_truncated_stream_withholds_done_for_a_continuation():
+    collector = StreamCollector(continuable=True)
+    assert collector.feed(delta('Summary:\n', 'length')) == [delta('Summary:\n', 'length')]
+    assert collector.feed(b'data: [DONE]') == []
+    assert collector.done_withheld
+
+
+def test_guard_stop_in_a_continuation_sends_done_once():
+    collector = StreamCollector(ReportStreamGuard(), continuable=True)
+    first = [delta(REPORT[:40], 'length'), b'data: [DONE]']
+    continuation = [delta(REPORT[40:] + '\nLet me know if this helps!\n')]
+    forwarded = relay(collector, first + continuation)
+    assert forwarded.count(b'data: [DONE]') == 1
+    assert forwarded[-2] == b'data: [DONE]'
+    assert collector.stopped
+    assert collector.text() == REPORT + '\n'